@@ -70,11 +70,15 @@ async def main(event_loop):
             requester = await process_requester(conn, request[6], request[5])
             date = datetime.strptime(request[7], '%Y-%m-%d %H:%M:%S %Z')
             note = request[8]
+            if await pakreq.pakreq.get_open_request(conn, rtype, name):
+                print('>>> Skipping request %s(%s): already open' %
+                      (name, get_type(rtype)))
+                continue
             print('>>> Adding request %s(%s): %s' % (name, get_type(rtype), desc))
             await pakreq.pakreq.new_request(
                 conn, rtype=rtype, name=name,
                 description=desc, requester_id=requester['id'],
-                packager_id=packager['id'], date=date,
+                packager_id=(packager['id'] or None), date=date,
                 note=note
             )
     # Close connections, clean up.
@@ -0,0 +1,12 @@
+\echo 'Replacing full-text search column with an expression index...'
+
+-- Declared in pakreq/db.py, queries use the same expression
+DROP INDEX request_search_idx;
+ALTER TABLE request DROP COLUMN search_vector;
+
+CREATE INDEX request_search_idx ON request USING GIN ((
+    setweight(to_tsvector('simple', name), 'A') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+));
+
+\echo 'Migration finished!'
@@ -0,0 +1,11 @@
+\echo 'Handing out IDs from sequences instead of max(id) + 1...'
+
+CREATE SEQUENCE IF NOT EXISTS user_id_seq OWNED BY "user".id;
+ALTER TABLE "user" ALTER COLUMN id SET DEFAULT nextval('user_id_seq');
+SELECT setval('user_id_seq', COALESCE((SELECT max(id) FROM "user"), 0) + 1, false);
+
+CREATE SEQUENCE IF NOT EXISTS request_id_seq OWNED BY request.id;
+ALTER TABLE request ALTER COLUMN id SET DEFAULT nextval('request_id_seq');
+SELECT setval('request_id_seq', COALESCE((SELECT max(id) FROM request), 0) + 1, false);
+
+\echo 'Migration finished!'
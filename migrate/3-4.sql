@@ -0,0 +1,15 @@
+\echo 'Rejecting duplicated open requests...'
+
+UPDATE request SET status = 'REJECTED', note = 'Duplicate of request ' || dup.first_id
+FROM (
+    SELECT id, min(id) OVER (PARTITION BY type, name) AS first_id
+    FROM request WHERE status = 'OPEN'
+) AS dup
+WHERE request.id = dup.id AND dup.id <> dup.first_id;
+
+\echo 'Creating index for open requests...'
+
+CREATE UNIQUE INDEX request_open_type_name_key ON request (type, name)
+    WHERE status = 'OPEN';
+
+\echo 'Migration finished!'
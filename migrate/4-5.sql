@@ -0,0 +1,5 @@
+\echo 'Creating index for OAuth IDs...'
+
+CREATE INDEX oauth_type_oid_idx ON oauth (type, oid);
+
+\echo 'Migration finished!'
@@ -0,0 +1,5 @@
+\echo 'Creating index for listing open requests...'
+
+CREATE INDEX request_open_id_idx ON request (id) WHERE status = 'OPEN';
+
+\echo 'Migration finished!'
@@ -0,0 +1,16 @@
+\echo 'Adding full-text search column...'
+
+ALTER TABLE request ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+    ) STORED;
+
+\echo 'Creating search indexes...'
+
+CREATE INDEX request_search_idx ON request USING GIN (search_vector);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX request_name_trgm_idx ON request USING GIN (name gin_trgm_ops);
+
+\echo 'Migration finished!'
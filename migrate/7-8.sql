@@ -0,0 +1,10 @@
+\echo 'Marking requests without packager as unclaimed...'
+
+UPDATE request SET packager_id = NULL WHERE packager_id = 0;
+
+\echo 'Creating index for unclaimed requests...'
+
+CREATE INDEX request_unclaimed_idx ON request (pub_date, id)
+    WHERE status = 'OPEN' AND packager_id IS NULL;
+
+\echo 'Migration finished!'
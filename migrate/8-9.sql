@@ -0,0 +1,58 @@
+\echo 'Adding revisions of requests and users...'
+
+-- Every written row of request or "user" gets a new revision from
+-- revision_seq, the revision of all requests is the greatest committed
+-- one. Writers hold the shared advisory lock 1885432690 until they commit,
+-- which tells readers whether an older revision may still be committed.
+-- Shared locks do not conflict, so writers never wait for each other.
+CREATE SEQUENCE revision_seq;
+
+ALTER TABLE request
+    ADD COLUMN revision bigint NOT NULL DEFAULT nextval('revision_seq'),
+    ADD COLUMN updated_at timestamptz NOT NULL DEFAULT now();
+
+ALTER TABLE "user"
+    ADD COLUMN revision bigint NOT NULL DEFAULT nextval('revision_seq'),
+    ADD COLUMN updated_at timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX request_revision_idx ON request (revision);
+CREATE INDEX user_revision_idx ON "user" (revision);
+
+CREATE FUNCTION revision_touch() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock_shared(1885432690);
+    NEW.revision := nextval('revision_seq');
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER revision_touch BEFORE INSERT OR UPDATE ON request
+    FOR EACH ROW EXECUTE PROCEDURE revision_touch();
+
+CREATE TRIGGER revision_touch BEFORE INSERT OR UPDATE ON "user"
+    FOR EACH ROW EXECUTE PROCEDURE revision_touch();
+
+\echo 'Adding revisions of deleted rows...'
+
+CREATE TABLE revision_tombstone (
+    revision bigint PRIMARY KEY,
+    deleted_at timestamptz NOT NULL
+);
+
+CREATE FUNCTION revision_tombstone() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock_shared(1885432690);
+    INSERT INTO revision_tombstone
+        VALUES (nextval('revision_seq'), clock_timestamp());
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER revision_tombstone AFTER DELETE ON request
+    FOR EACH ROW EXECUTE PROCEDURE revision_tombstone();
+
+CREATE TRIGGER revision_tombstone AFTER DELETE ON "user"
+    FOR EACH ROW EXECUTE PROCEDURE revision_tombstone();
+
+\echo 'Migration finished!'
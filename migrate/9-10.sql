@@ -0,0 +1,11 @@
+\echo 'Creating web session table...'
+
+CREATE TABLE web_session (
+    id varchar PRIMARY KEY,
+    data text NOT NULL,
+    expires timestamptz NOT NULL
+);
+
+CREATE INDEX web_session_expires_idx ON web_session (expires);
+
+\echo 'Migration finished!'
@@ -0,0 +1,111 @@
+# cache.py
+
+"""
+Async caching utils
+"""
+
+import time
+import asyncio
+
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """LRU cache with separate TTLs for positive and negative results,
+    concurrent lookups of the same key share one in-flight fetch"""
+
+    def __init__(self, maxsize=1024, ttl=600, negative_ttl=60,
+                 is_negative=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.is_negative = is_negative or (lambda value: value is None)
+        self.entries = OrderedDict()
+        self.inflight = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.lookup(key)[0]
+
+    def lookup(self, key):
+        """Return (found, value) without touching the counters"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, value
+
+    def get(self, key, default=None):
+        """Get cached value of key"""
+        found, value = self.lookup(key)
+        if found:
+            self.hits += 1
+            return value
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """Cache value of key"""
+        ttl = self.negative_ttl if self.is_negative(value) else self.ttl
+        if ttl <= 0:
+            self.entries.pop(key, None)
+            return
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drop key from cache"""
+        self.entries.pop(key, None)
+
+    def clear(self):
+        """Drop everything from cache"""
+        self.entries.clear()
+
+    async def get_or_fetch(self, key, fetch):
+        """Get cached value of key, or await fetch() and cache its result"""
+        found, value = self.lookup(key)
+        if found:
+            self.hits += 1
+            return value
+        self.misses += 1
+        future = self.inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_event_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve it here so waiter-less failures are not reported
+            future.exception()
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self.inflight[key]
+
+    def stats(self):
+        """Cache statistics"""
+        total = self.hits + self.misses
+        return dict(
+            size=len(self.entries), maxsize=self.maxsize,
+            hits=self.hits, misses=self.misses,
+            hit_rate=(self.hits / total if total else 0.0),
+            inflight=len(self.inflight)
+        )
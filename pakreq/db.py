@@ -5,14 +5,19 @@ Database management utils
 """
 
 import enum
+import time
+import asyncio
+import logging
 import aiopg.sa
 from argon2 import PasswordHasher
 
 from sqlalchemy import (
-    MetaData, Table, Column, ForeignKey,
-    Integer, String, Date, Boolean, Enum, select, func
+    MetaData, Table, Column, ForeignKey, Index, Sequence, DDL, event,
+    Integer, BigInteger, String, Date, DateTime, Boolean, Enum, and_, func
 )
 
+logger = logging.getLogger(__name__)
+
 
 class RequestType(enum.Enum):
     """Types of requests"""
@@ -37,6 +42,12 @@ class OAuthType(enum.Enum):
 
 META = MetaData()
 
+# Revisions of written rows of requests and users, see pakreq.get_revision
+REVISION_SEQ = Sequence('revision_seq', metadata=META)
+
+# Advisory lock held (shared) by transactions writing revisions
+REVISION_LOCK = 1885432690
+
 
 # Users table
 USER = Table(
@@ -46,9 +57,16 @@ USER = Table(
     Column('username', String, nullable=False, unique=True),
     Column('admin', Boolean, nullable=False),  # 0 -> non-admin, 1 -> admin
     Column('password_hash', String, nullable=True),
+    # Maintained by a trigger on insert and update
+    Column('revision', BigInteger, nullable=False,
+           server_default=REVISION_SEQ.next_value()),
+    Column('updated_at', DateTime(timezone=True), nullable=False,
+           server_default=func.now()),
     sqlite_autoincrement=True
 )
 
+Index('user_revision_idx', USER.c.revision)
+
 
 # Request table
 REQUEST = Table(
@@ -63,9 +81,87 @@ REQUEST = Table(
     Column('packager_id', Integer, ForeignKey('user.id')),
     Column('pub_date', Date, nullable=False),
     Column('note', String, nullable=True),
+    # Maintained by a trigger on insert and update
+    Column('revision', BigInteger, nullable=False,
+           server_default=REVISION_SEQ.next_value()),
+    Column('updated_at', DateTime(timezone=True), nullable=False,
+           server_default=func.now()),
     sqlite_autoincrement=True
 )
 
+Index('request_revision_idx', REQUEST.c.revision)
+
+# At most one open request of each type per package, also serves
+# duplicate checks of new requests
+Index(
+    'request_open_type_name_key',
+    REQUEST.c.type, REQUEST.c.name,
+    unique=True,
+    postgresql_where=(REQUEST.c.status == RequestStatus.OPEN)
+)
+
+# Full-text search document of requests, names weigh more than
+# descriptions. Queries must use this very expression to use the index.
+SEARCH_VECTOR = func.setweight(
+    func.to_tsvector('simple', REQUEST.c.name), 'A'
+).op('||')(func.setweight(
+    func.to_tsvector('simple', func.coalesce(REQUEST.c.description, '')), 'B'
+))
+
+Index('request_search_idx', SEARCH_VECTOR, postgresql_using='gin')
+
+# Substring and similarity search of names
+Index(
+    'request_name_trgm_idx',
+    REQUEST.c.name,
+    postgresql_using='gin',
+    postgresql_ops={'name': 'gin_trgm_ops'}
+)
+
+event.listen(
+    REQUEST, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(
+        dialect='postgresql'
+    )
+)
+
+# Listing open requests in ID order
+Index(
+    'request_open_id_idx',
+    REQUEST.c.id,
+    postgresql_where=(REQUEST.c.status == RequestStatus.OPEN)
+)
+
+# Queue of unclaimed open requests, oldest first
+Index(
+    'request_unclaimed_idx',
+    REQUEST.c.pub_date, REQUEST.c.id,
+    postgresql_where=and_(
+        REQUEST.c.status == RequestStatus.OPEN,
+        REQUEST.c.packager_id.is_(None)
+    )
+)
+
+# Revisions taken by deleted requests and users, added by a trigger
+REVISION_TOMBSTONE = Table(
+    'revision_tombstone', META,
+
+    Column('revision', BigInteger, primary_key=True),
+    Column('deleted_at', DateTime(timezone=True), nullable=False)
+)
+
+# Server-side web sessions
+WEB_SESSION = Table(
+    'web_session', META,
+
+    Column('id', String, primary_key=True),
+    Column('data', String, nullable=False),
+    Column('expires', DateTime(timezone=True), nullable=False)
+)
+
+# Purging expired sessions
+Index('web_session_expires_idx', WEB_SESSION.c.expires)
+
 # OAuth
 OAUTH = Table(
     'oauth', META,
@@ -76,21 +172,151 @@ OAUTH = Table(
     Column('token', String)
 )
 
+# Looking up accounts by OAuth ID
+Index('oauth_type_oid_idx', OAUTH.c.type, OAUTH.c.oid)
+
 
 class RecordNotFoundException(Exception):
     """Requested record in database was not found"""
 
 
+class DuplicateRecordException(Exception):
+    """Record conflicts with an existing one in database"""
+
+
+class _AcquireContext(object):
+    """Result of PoolMonitor.acquire, usable both as `await` and
+    `async with`, like the one of aiopg engines"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __await__(self):
+        return self.pool._acquire().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.pool._acquire()
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        # Closing a SAConnection releases it back to the engine
+        await self.conn.close()
+        self.conn = None
+
+
+class PoolMonitor(object):
+    """Wraps an aiopg.sa engine, bounding and timing connection
+    acquisitions. Everything else is passed through to the engine."""
+
+    # Upper bounds (seconds) of acquire latency histogram buckets
+    BUCKETS = (0.001, 0.01, 0.1, 1, 10)
+
+    def __init__(self, engine, acquire_timeout=10, slow_wait=0.5):
+        self.engine = engine
+        self.acquire_timeout = acquire_timeout
+        self.slow_wait = slow_wait
+        self.waiting = 0
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def acquire(self):
+        """Get a connection from pool"""
+        return _AcquireContext(self)
+
+    async def _acquire(self):
+        queued = time.monotonic()
+        self.waiting += 1
+        acquiring = asyncio.ensure_future(self.engine.acquire())
+        try:
+            await asyncio.wait(
+                [acquiring], timeout=self.acquire_timeout or None
+            )
+        except asyncio.CancelledError:
+            self.abandon(acquiring)
+            raise
+        finally:
+            self.waiting -= 1
+        if not acquiring.done():
+            self.abandon(acquiring)
+            self.timeouts += 1
+            logger.warning(
+                'Timed out waiting %.2fs for a database connection (%s)' %
+                (time.monotonic() - queued, self.stats())
+            )
+            raise asyncio.TimeoutError()
+        conn = acquiring.result()
+        self.record(time.monotonic() - queued)
+        return conn
+
+    @staticmethod
+    def abandon(acquiring):
+        """Give up an acquisition, releasing the connection should it be
+        acquired anyway (cancelling may come too late)"""
+        def release(acquiring):
+            if not acquiring.cancelled() and acquiring.exception() is None:
+                asyncio.ensure_future(acquiring.result().close())
+        acquiring.cancel()
+        acquiring.add_done_callback(release)
+
+    def record(self, wait):
+        """Account an acquisition that took wait seconds"""
+        self.acquisitions += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        for i, bound in enumerate(self.BUCKETS):
+            if wait <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+        if wait > self.slow_wait:
+            logger.warning(
+                'Waited %.2fs for a database connection (%s waiting, '
+                '%s/%s in use)' % (wait, self.waiting,
+                                   self.engine.size - self.engine.freesize,
+                                   self.engine.maxsize)
+            )
+
+    def stats(self):
+        """Pool usage and acquire latency statistics"""
+        return dict(
+            size=self.engine.size, maxsize=self.engine.maxsize,
+            acquired=(self.engine.size - self.engine.freesize),
+            free=self.engine.freesize, waiting=self.waiting,
+            acquisitions=self.acquisitions, timeouts=self.timeouts,
+            wait_avg=(self.wait_total / self.acquisitions
+                      if self.acquisitions else 0.0),
+            wait_max=self.wait_max,
+            histogram=list(zip(self.BUCKETS + (None, ), self.histogram))
+        )
+
+
 async def init_db(app):
-    """Initialize database connection"""
+    """Initialize database connection pool"""
     conf = app['config']['db']
     engine = await aiopg.sa.create_engine(
         user=conf['username'],
         database=conf['database'],
         host=conf['host'],
-        password=conf['password']
+        port=conf['port'],
+        password=conf['password'],
+        minsize=conf['minsize'],
+        maxsize=conf['maxsize'],
+        # Enforced by aiopg rather than with server-side statement_timeout,
+        # which aiopg would surface as a CancelledError
+        timeout=conf['statement_timeout']
+    )
+    app['db'] = PoolMonitor(
+        engine, acquire_timeout=conf['acquire_timeout'],
+        slow_wait=conf['slow_wait']
     )
-    app['db'] = engine
 
 
 async def close_db(app):
@@ -120,47 +346,58 @@ async def get_row(conn, table, id):
     return dict(zip(result.keys(), result.values()))
 
 
-async def get_max_id(conn, table: Table):
-    """Get max id of a table"""
-    max_id = await conn.execute(select([func.max(table.c.id)]))
-    max_id = await max_id.fetchone()
-    if max_id:
-        return max_id[0] or 0
-    else:
-        return 0
-
-
-async def update_row(conn, table, id, kwargs):
-    """Update row by ID"""
-    if kwargs is not None:
-        orig_values = await get_row(conn, table, id)
-        new_values = dict()
-        for key, value in orig_values.items():
-            if key in kwargs:
-                new_values[key] = kwargs.get(key)
-            else:
-                new_values[key] = value
-        await conn.execute(
-            table.update(None)
-            .where(table.c.id == id)
-            .values(
-                new_values
-            )
-        )
+async def update_row(conn, table, id, kwargs, where=None):
+    """Update only the given columns of a row by ID, optionally only if it
+    also matches `where`, returns the updated row"""
+    if not kwargs:
+        return await get_row(conn, table, id)
+    condition = table.c.id == id
+    if where is not None:
+        condition = and_(condition, where)
+    result = await conn.execute(
+        table.update(None)
+        .where(condition)
+        .values(kwargs)
+        .returning(*table.c)
+    )
+    result = await result.fetchone()
+    if result is None:
+        msg = "Row with id: {} does not exists"
+        raise RecordNotFoundException(msg.format(id))
+    return dict(zip(result.keys(), result.values()))
+
+
+async def update_rows(conn, table, ids, kwargs, where=None):
+    """Update many rows by ID with the same values in one statement,
+    optionally only those also matching `where`, returns IDs of the
+    updated rows"""
+    if not ids:
+        return []
+    condition = table.c.id.in_(ids)
+    if where is not None:
+        condition = and_(condition, where)
+    result = await conn.execute(
+        table.update(None)
+        .where(condition)
+        .values(kwargs)
+        .returning(table.c.id)
+    )
+    return [r[0] for r in await result.fetchall()]
 
 
-async def check_password(conn, name, password):
-    """Check password and rotate cleartext password if needed"""
-    from pakreq.pakreq import update_user, get_user_by_name
-    from pakreq.utils import password_hash, password_verify, get_password_hasher
-    user = await get_user_by_name(conn, name)
+async def check_password(conn, passwords, user, password):
+    """Check password of user (a row of USER) and rotate cleartext password
+    if needed, hashing is done by `passwords` (a
+    pakreq.passwords.PasswordService)"""
+    from pakreq.pakreq import update_user
+    from pakreq.utils import get_password_hasher
     status = False
     hash = user['password_hash']
-    if password_verify(user['id'], password, hash):
+    if await passwords.verify(user['id'], password, hash):
         status = True
         hasher = get_password_hasher()
         if hasher.check_needs_rehash(hash):
-            hash = password_hash(user['id'], password)
+            hash = await passwords.hash(user['id'], password)
             await update_user(conn, user['id'], password_hash=hash)
 
     return status
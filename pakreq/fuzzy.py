@@ -0,0 +1,72 @@
+# fuzzy.py
+
+"""
+In-memory fuzzy name index
+"""
+
+import sys
+
+from collections import Counter
+
+
+def trigrams(text):
+    """Split text into trigrams the way pg_trgm does"""
+    text = '  %s ' % text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(object):
+    """Trigram index over short names (package names), answers similarity
+    lookups without touching the database"""
+
+    def __init__(self):
+        self.names = dict()
+        self.postings = dict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, key, name):
+        """Index name under key, replacing what key pointed to before"""
+        if key in self.names:
+            self.remove(key)
+        self.names[key] = name
+        for trigram in trigrams(name):
+            self.postings.setdefault(trigram, set()).add(key)
+
+    def remove(self, key):
+        """Drop key from index"""
+        name = self.names.pop(key, None)
+        if name is None:
+            return
+        for trigram in trigrams(name):
+            keys = self.postings.get(trigram)
+            keys.discard(key)
+            if not keys:
+                del self.postings[trigram]
+
+    def search(self, name, limit=5, threshold=0.3):
+        """Find names similar to name, returns [(key, name, similarity)]
+        ordered by similarity"""
+        query = trigrams(name)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self.postings.get(trigram, ()))
+        results = []
+        for key, count in shared.items():
+            # Jaccard similarity of the two trigram sets
+            total = len(query) + len(trigrams(self.names[key])) - count
+            similarity = count / total
+            if similarity >= threshold:
+                results.append((key, self.names[key], similarity))
+        results.sort(key=lambda r: (-r[2], r[0]))
+        return results[:limit]
+
+    def memory_usage(self):
+        """Approximate memory used by the index, in bytes"""
+        size = sys.getsizeof(self.names) + sys.getsizeof(self.postings)
+        for key, name in self.names.items():
+            size += sys.getsizeof(key) + sys.getsizeof(name)
+        for trigram, keys in self.postings.items():
+            size += sys.getsizeof(trigram) + sys.getsizeof(keys)
+        return size
@@ -0,0 +1,131 @@
+# httpcache.py
+
+"""
+HTTP caching of pages and API responses derived from requests
+"""
+
+import zlib
+
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+from pakreq.cache import TTLCache
+from pakreq.pakreq import get_revision
+
+
+def not_modified(request, etag, modified, personal=False):
+    """Whether the client already has the representation of etag. The
+    date alone cannot tell whose representation the client has, so
+    personal ones are only validated by ETag."""
+    if request.if_none_match is not None:
+        return any(tag.value in (etag, '*') for tag in request.if_none_match)
+    if request.if_modified_since is not None and not personal:
+        # HTTP dates have no sub-second part
+        return modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def set_validators(response, etag, modified, personal=False):
+    """Let clients make conditional requests of response"""
+    response.etag = etag
+    response.last_modified = modified
+    response.headers['Cache-Control'] = 'no-cache'
+    if personal:
+        set_personal(response)
+
+
+def set_personal(response):
+    """Keep caches from serving response to other sessions"""
+    response.headers['Vary'] = 'Cookie'
+
+
+def make_etag(request, revision, variant=None, personal=False):
+    """ETag of the representation of request at revision, distinct for
+    each query and each variant, and each user if personal"""
+    etag = str(revision)
+    if personal:
+        etag += '-%s' % ('anonymous' if variant is None else variant)
+    elif variant is not None:
+        etag += '-%s' % variant
+    if request.query:
+        query = urlencode(sorted(request.query.items()))
+        etag += '-%08x' % zlib.crc32(query.encode())
+    return etag
+
+
+class ResponseCache(object):
+    """Responses rendered at the current revision of requests (see
+    pakreq.get_revision). The revision is looked up at most every
+    revision_ttl seconds, responses of older revisions are never served.
+    While the revision is not settled, responses are neither cached nor
+    validated."""
+
+    def __init__(self, maxsize=256, revision_ttl=1):
+        self.revision = TTLCache(maxsize=1, ttl=revision_ttl)
+        self.responses = TTLCache(
+            maxsize=maxsize, ttl=float('inf'), is_negative=lambda _: False
+        )
+
+    async def get_revision(self, app):
+        """Current (revision, updated_at, settled) of requests"""
+        async def fetch():
+            async with app['db'].acquire() as conn:
+                return await get_revision(conn)
+        return await self.revision.get_or_fetch(None, fetch)
+
+    async def check(self, request, variant=None, personal=False):
+        """Validators of the current revision, as (etag, modified,
+        response), response is a 304 if the client is up to date. The ETag
+        differs for each variant of a resource; personal resources (which
+        depend on the session) have the logged in user, or None, as
+        variant. Both validators are None if the revision is not
+        settled."""
+        revision, modified, settled = await self.get_revision(request.app)
+        if not settled:
+            return None, None, None
+        etag = make_etag(request, revision, variant, personal)
+        if not not_modified(request, etag, modified, personal):
+            return etag, modified, None
+        response = web.Response(status=304)
+        set_validators(response, etag, modified, personal)
+        return etag, modified, response
+
+    async def respond(self, request, render, variant=None, personal=False):
+        """Respond to request with a cached response, or the one rendered
+        by `await render()` (only successful ones are cached)"""
+        etag, modified, response = await self.check(
+            request, variant, personal
+        )
+        if response is not None:
+            return response
+        if etag is None:
+            response = await render()
+            if personal:
+                set_personal(response)
+            return response
+        key = (etag, request.path_qs)
+        cached = self.responses.get(key)
+        if cached is None:
+            response = await render()
+            if response.status != 200:
+                return response
+            cached = (response.body, response.content_type, response.charset)
+            self.responses.set(key, cached)
+        response = web.Response(
+            body=cached[0], content_type=cached[1], charset=cached[2]
+        )
+        set_validators(response, etag, modified, personal)
+        return response
+
+    def stats(self):
+        """Cache statistics"""
+        return self.responses.stats()
+
+
+async def init_response_cache(app):
+    """Initialize cache of rendered responses"""
+    conf = app['config']['web']
+    app['responses'] = ResponseCache(
+        maxsize=conf['cache_size'], revision_ttl=conf['revision_ttl']
+    )
@@ -1,8 +1,16 @@
+import hmac
+import queue
+import asyncio
+import hashlib
 import logging
+import secrets
 import ldap
 
+from concurrent.futures import ThreadPoolExecutor
 from ldap.sasl import CB_AUTHNAME, CB_PASS
 
+from pakreq.cache import TTLCache
+
 LDAP_SRV = None
 LDAP_AVAILABLE = False
 
@@ -25,40 +33,151 @@ def parse_username(dn):
 
 
 class PakreqLDAP(object):
-    def __init__(self, url):
+    """LDAP authentication backend. Binds run in a small thread pool, each
+    worker reuses TLS-established connections from a shared pool, and
+    successful logins are remembered for `cache_ttl` seconds"""
+
+    def __init__(self, url, pool_size=2, timeout=10, cache_ttl=300,
+                 connect=None):
         self.ldap_avail = False
+        self.ldap_url = url
+        self.timeout = timeout
+        self.connect = connect or self.open_connection
+        self.idle = queue.LifoQueue(maxsize=pool_size)
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix='ldap'
+        )
+        # Only successful binds are cached, keyed by a salted digest so no
+        # cleartext password is kept around
+        self.cache = TTLCache(ttl=cache_ttl, negative_ttl=0,
+                              is_negative=lambda value: not value)
+        self.secret = secrets.token_bytes(32)
         if not url:
             logging.warning('LDAP authentication disabled, no URL')
             return
-        test_conn = ldap.initialize(url)
         try:
-            test_conn.start_tls_s()
-            self.ldap_avail = True
-        except ldap.OPERATIONS_ERROR:
+            self.release(self.connect())
             self.ldap_avail = True
-            # TLS already established, will throw OP_ERR
         except Exception:
             logging.warning('LDAP authentication disabled, invalid config')
 
         if self.ldap_avail:
-            self.ldap_url = url
             logging.info('LDAP authentication enabled.')
 
-    def ldap_login(self, user, pwd):
-        if not self.ldap_avail:
-            return False
-        aosc_sso = ldap.initialize(self.ldap_url)
+    def open_connection(self):
+        """Open a new TLS-established connection"""
+        conn = ldap.initialize(self.ldap_url)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+        conn.set_option(ldap.OPT_TIMEOUT, self.timeout)
         try:
-            aosc_sso.start_tls_s()
-        except Exception:
+            conn.start_tls_s()
+        except ldap.OPERATIONS_ERROR:
+            # TLS already established, will throw OP_ERR
             pass
-        dn = None
+        return conn
+
+    def release(self, conn):
+        """Put conn back into the pool, or close it if the pool is full"""
         try:
-            aosc_sso.sasl_interactive_bind_s('', freeipa_login(user, pwd))
-            dn = aosc_sso.whoami_s()
-            aosc_sso.unbind()
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.unbind()
+
+    def discard(self, conn):
+        """Close a connection in an unknown state"""
+        try:
+            conn.unbind()
         except Exception:
+            pass
+
+    def ldap_login(self, user, pwd):
+        """Blocking login, reusing a pooled connection"""
+        if not self.ldap_avail:
             return False
+        try:
+            conn = self.idle.get_nowait()
+            pooled = True
+        except queue.Empty:
+            conn = None
+            pooled = False
+        while True:
+            if conn is None:
+                try:
+                    conn = self.connect()
+                except Exception:
+                    return False
+            try:
+                conn.sasl_interactive_bind_s('', freeipa_login(user, pwd))
+                dn = conn.whoami_s()
+                break
+            except ldap.INVALID_CREDENTIALS:
+                # Connection is still fine, it just stays unauthenticated
+                self.release(conn)
+                return False
+            except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT):
+                self.discard(conn)
+                if not pooled:
+                    return False
+                # Pooled connection went stale while idle (or the server
+                # restarted), try once more on a new one
+                conn = None
+                pooled = False
+            except Exception:
+                # Connection is in an unknown state, drop it
+                self.discard(conn)
+                return False
+        self.release(conn)
         if not dn:
             return False
         return True
+
+    async def login(self, user, pwd):
+        """Login without blocking the event loop"""
+        if not self.ldap_avail:
+            return False
+        key = hmac.new(
+            self.secret, ('%s\0%s' % (user, pwd)).encode(), hashlib.sha256
+        ).digest()
+        if self.cache.get(key):
+            return True
+        try:
+            status = await asyncio.wait_for(
+                asyncio.get_event_loop().run_in_executor(
+                    self.executor, self.ldap_login, user, pwd
+                ),
+                self.timeout
+            )
+        except asyncio.TimeoutError:
+            logging.warning('LDAP login of %s timed out' % user)
+            return False
+        if status:
+            self.cache.set(key, True)
+        return status
+
+    def close(self):
+        """Close all pooled connections"""
+        self.executor.shutdown(wait=False)
+        while True:
+            try:
+                self.idle.get_nowait().unbind()
+            except queue.Empty:
+                break
+            except Exception:
+                pass
+
+
+async def init_ldap(app):
+    """Initialize LDAP authentication backend"""
+    conf = app['config']['ldap']
+    # Connecting to the server for the first time blocks
+    app['ldap'] = await asyncio.get_event_loop().run_in_executor(
+        None, lambda: PakreqLDAP(
+            app['config']['ldap_url'], pool_size=conf['pool_size'],
+            timeout=conf['timeout'], cache_ttl=conf['cache_ttl']
+        )
+    )
+
+
+async def close_ldap(app):
+    """Close LDAP authentication backend"""
+    app['ldap'].close()
@@ -10,6 +10,7 @@ from multiprocessing import Process
 from pakreq.pakreq import start_daemon
 from pakreq.settings import get_config
 from pakreq.telegram import start_bot
+from pakreq.web import start_web, serves_webhook
 
 def main(argv):
     """Main!"""
@@ -18,25 +19,35 @@ def main(argv):
 
     config = get_config(argv)
 
-    # Start telegram process
-    telegram_process = Process(
-        target=start_bot, args=(config,)
-    )
-    telegram_process.start()
+    processes = []
+
+    # Start telegram process, unless the web server serves its webhook
+    if not serves_webhook(config):
+        processes.append(Process(
+            target=start_bot, args=(config,)
+        ))
 
     # Maintenance daemon
-    daemon_process = Process(
+    processes.append(Process(
         target=start_daemon, args=(config,)
-    )
-    daemon_process.start()
+    ))
+
+    # Web server
+    processes.append(Process(
+        target=start_web, args=(config,)
+    ))
+
+    for process in processes:
+        process.start()
 
     try:
-        telegram_process.join()
-        daemon_process.join()
+        for process in processes:
+            process.join()
     finally:
         print('\rBye-Bye!')
-        os.kill(telegram_process.pid, signal.SIGINT)
-        os.kill(daemon_process.pid, signal.SIGINT)
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
         exit(0)
 
 
@@ -4,37 +4,209 @@
 Simple packages site API library
 """
 
+import ujson
+import asyncio
 import logging
 
-from aiohttp import ClientSession, client_exceptions
+from aiohttp import (
+    ClientSession, ClientTimeout, TCPConnector, client_exceptions
+)
+
+from pakreq.cache import TTLCache
 
 BASE_URL = 'https://packages.aosc.io'
 logger = logging.getLogger(__name__)
 
 
-async def make_request(url, params={}):
-    """Make request to packages site"""
-    session = ClientSession()
-    if 'type' not in params.keys():
-        params['type'] = 'json'
-    async with session.get(url, params=params) as resp:
-        try:
-            result = await resp.json()
-        except client_exceptions.ContentTypeError as e:
-            logger.error(
-                'Request failed: url (%s) params (%s) exception (%s)' % (url, params, e)
-            )
-            await session.close()
-            return None
-    await session.close()
-    return result
-
-
-async def search_packages(name):
-    """Search packages on packages site"""
-    return await make_request('%s/search/' % BASE_URL, {'q': name})
-
-
-async def get_package_info(name):
-    """Get detailed info of a package from packages site"""
-    return await make_request('%s/packages/%s' % (BASE_URL, name))
+def is_not_found(result):
+    """Whether a packages site response means the package is not there"""
+    if not result:
+        return True
+    return not (result.get('pkg') or result.get('packages'))
+
+
+class PackageIndex(object):
+    """In-memory name -> version index of the whole packages site, answers
+    the same queries as PackagesClient without touching the network"""
+
+    def __init__(self, packages=()):
+        self.versions = dict()
+        for package in packages:
+            self.versions[package['name']] = \
+                package.get('version') or package.get('dpkg_version')
+
+    def __len__(self):
+        return len(self.versions)
+
+    @classmethod
+    def from_json(cls, data):
+        """Build index from a packages site listing (str, bytes or parsed)"""
+        if isinstance(data, (str, bytes, bytearray)):
+            data = ujson.loads(data)
+        if isinstance(data, dict):
+            data = data['packages']
+        return cls(data)
+
+    @classmethod
+    def from_file(cls, path):
+        """Build index from a packages site listing saved on disk"""
+        with open(path, 'rb') as f:
+            return cls.from_json(f.read())
+
+    async def search_packages(self, name):
+        """Search packages named either name or name without dashes"""
+        names = [name] if name in self.versions else []
+        stripped = name.replace('-', '')
+        if stripped in self.versions and stripped != name:
+            names.append(stripped)
+        return {'packages': [
+            dict(name=n, version=self.versions[n]) for n in names
+        ]}
+
+    async def get_package_info(self, name):
+        """Get name and version of a package"""
+        if name not in self.versions:
+            # Truthy like the site's 404 body, so find_package keeps going
+            return {'error': 'Package not found'}
+        return {'pkg': dict(name=name, version=self.versions[name])}
+
+
+class RateLimiter(object):
+    """Space calls out to at most `rate` per second, 0 means unlimited"""
+
+    def __init__(self, rate=0):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0
+
+    async def wait(self):
+        """Wait until the next slot is available"""
+        if not self.interval:
+            return
+        now = asyncio.get_event_loop().time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class PackagesClient(object):
+    """Long-lived packages site client, owns one pooled HTTP session"""
+
+    def __init__(self, base_url=BASE_URL, connections=8, keepalive=60,
+                 timeout=30, rate_limit=0, cache_size=4096, cache_ttl=1800,
+                 cache_negative_ttl=300, snapshot_path='/list.json'):
+        self.base_url = base_url.rstrip('/')
+        self.snapshot_path = snapshot_path
+        self.connections = connections
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.session = None
+        self.limiter = RateLimiter(rate_limit)
+        self.cache = TTLCache(
+            maxsize=cache_size, ttl=cache_ttl,
+            negative_ttl=cache_negative_ttl, is_negative=is_not_found
+        )
+
+    async def start(self):
+        """Open the pooled session (must be called inside the event loop)"""
+        if self.session is not None:
+            return
+        connector = TCPConnector(
+            limit=self.connections,
+            limit_per_host=self.connections,
+            keepalive_timeout=self.keepalive
+        )
+        self.session = ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(total=self.timeout)
+        )
+
+    async def close(self):
+        """Close the pooled session and all of its connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def make_request(self, path, params=None):
+        """Make request to packages site, returns None if not found and
+        raises aiohttp.ClientError if the site fails"""
+        if self.session is None:
+            await self.start()
+        url = '%s%s' % (self.base_url, path)
+        params = dict(params or {})
+        params.setdefault('type', 'json')
+        await self.limiter.wait()
+        async with self.session.get(url, params=params) as resp:
+            # Errors of the site are raised, so they are not cached as the
+            # package not being there
+            if resp.status != 404:
+                resp.raise_for_status()
+            try:
+                return await resp.json()
+            except client_exceptions.ContentTypeError as e:
+                if resp.status == 404:
+                    return None
+                logger.error(
+                    'Request failed: url (%s) params (%s) exception (%s)' %
+                    (url, params, e)
+                )
+                raise
+
+    async def get_index(self, chunk_size=65536):
+        """Download the full package listing in one streaming request and
+        build a PackageIndex from it"""
+        if self.session is None:
+            await self.start()
+        url = '%s%s' % (self.base_url, self.snapshot_path)
+        body = bytearray()
+        await self.limiter.wait()
+        # The listing is much larger than a single lookup, so it is allowed
+        # to take longer than the per-request timeout
+        async with self.session.get(
+                url, params={'type': 'json'},
+                timeout=ClientTimeout(total=None,
+                                      sock_read=self.timeout)) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                body.extend(chunk)
+        index = PackageIndex.from_json(body)
+        logger.info('Fetched packages site snapshot: %s packages, %s bytes' %
+                    (len(index), len(body)))
+        return index
+
+    async def search_packages(self, name):
+        """Search packages on packages site"""
+        return await self.cache.get_or_fetch(
+            ('search', name),
+            lambda: self.make_request('/search/', {'q': name})
+        )
+
+    async def get_package_info(self, name):
+        """Get detailed info of a package from packages site"""
+        return await self.cache.get_or_fetch(
+            ('info', name),
+            lambda: self.make_request('/packages/%s' % name)
+        )
+
+
+async def init_packages(app):
+    """Initialize packages site client"""
+    conf = app['config']['packages']
+    client = PackagesClient(
+        base_url=conf['url'],
+        connections=conf['connections'],
+        keepalive=conf['keepalive'],
+        timeout=conf['timeout'],
+        rate_limit=conf['rate_limit'],
+        cache_size=conf['cache_size'],
+        cache_ttl=conf['cache_ttl'],
+        cache_negative_ttl=conf['cache_negative_ttl'],
+        snapshot_path=conf['snapshot_path']
+    )
+    await client.start()
+    app['packages'] = client
+
+
+async def close_packages(app):
+    """Close packages site client"""
+    await app['packages'].close()
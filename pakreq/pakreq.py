@@ -1,32 +1,44 @@
 # pakreq.py
 
+import time
 import uvloop
 import asyncio
 import logging
 
-from datetime import datetime
+from datetime import datetime, timezone
 from packaging import version
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from pakreq.db import (
-    OAuthType, RequestStatus, RequestType, REQUEST, USER, OAUTH
+    OAuthType, RequestStatus, RequestType, REQUEST, REVISION_LOCK,
+    REVISION_TOMBSTONE, SEARCH_VECTOR, USER, OAUTH, WEB_SESSION,
+    DuplicateRecordException, RecordNotFoundException
 )
-from pakreq.db import get_max_id, get_row, get_rows, update_row, init_db
-from pakreq.packages import get_package_info, search_packages
+from pakreq.db import (
+    get_row, get_rows, update_row, update_rows, init_db, close_db
+)
+from pakreq.packages import init_packages, close_packages
+from pakreq.utils import HIGHLIGHT_START, HIGHLIGHT_STOP
 
-from sqlalchemy.sql import (select, or_, and_)
+from psycopg2 import IntegrityError
+from psycopg2.errorcodes import UNIQUE_VIOLATION
+from sqlalchemy.sql import (
+    select, or_, and_, func, tuple_, union_all
+)
+from sqlalchemy.dialects.postgresql import insert
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def find_package(name):
-    info = await get_package_info(name)
+async def find_package(packages, name):
+    """Find the name a package is known as on packages site"""
+    info = await packages.get_package_info(name)
     if not info:
         return None
     if 'pkg' in info.keys():
         return info['pkg']['name']
-    info = await search_packages(name)
+    info = await packages.search_packages(name)
     if not info:
         return None
     name_stripped = name.replace('-', '')
@@ -36,50 +48,149 @@ async def find_package(name):
     return None
 
 
+async def check_request(packages, request):
+    """Check an open request against packages site, returns the new
+    (status, note) of the request, or None if it should stay open"""
+    if request['type'] == RequestType.PAKREQ:
+        if await find_package(packages, request['name']):
+            return RequestStatus.DONE, '(BOT) This package has been packaged.'
+    elif request['type'] == RequestType.UPDREQ:
+        if await find_package(packages, request['name']):
+            info = await packages.get_package_info(request['name'])
+            if version.parse(info['pkg']['version']) >= \
+                    version.parse(request['description']):
+                return (
+                    RequestStatus.DONE,
+                    '(BOT) This package has been updated to: %s' %
+                    info['pkg']['version']
+                )
+        else:
+            return RequestStatus.REJECTED, '404 Package not found'
+    return None
+
+
 async def new_request(
     conn, id=None, status=RequestStatus.OPEN, rtype=RequestType.PAKREQ,
     name='Unknown', description='Unknown',
     requester_id=None, packager_id=None,
     date=None, note=None
 ):
-    """Create new request"""
+    """Create new request, returns its ID"""
     # Initializing values
-    id = id or (await get_max_id(conn, REQUEST) + 1)
-    statement = REQUEST.insert(None).values(
-        id=id, status=status, type=rtype, name=name,
+    values = dict(
+        status=status, type=rtype, name=name,
         description=description, requester_id=requester_id,
         packager_id=packager_id, pub_date=(date or datetime.now()),
         note=note
     )
-    await conn.execute(statement)
+    # IDs are allocated by the database unless explicitly given
+    if id is not None:
+        values['id'] = id
+    statement = REQUEST.insert(None).values(values).returning(REQUEST.c.id)
+    try:
+        result = await conn.execute(statement)
+    except IntegrityError as e:
+        if e.pgcode != UNIQUE_VIOLATION:
+            raise
+        # Caught by request_open_type_name_key
+        raise DuplicateRecordException(
+            '%s %s is already open' % (rtype.name, name)
+        ) from e
+    return await result.scalar()
+
+
+def user_brief(user_id, username, admin):
+    """Brief user info embedded in request details"""
+    if user_id is None:
+        return dict(id='0', username='Unknown')
+    return dict(id=user_id, username=username, admin=admin)
+
+
+def request_details_query():
+    """Query of requests joined with their requester and packager"""
+    requester = USER.alias('requester')
+    packager = USER.alias('packager')
+    return select([
+        REQUEST,
+        requester.c.username.label('requester_username'),
+        requester.c.admin.label('requester_admin'),
+        packager.c.username.label('packager_username'),
+        packager.c.admin.label('packager_admin'),
+        # IDs of the joined rows, NULL if the user does not exist
+        requester.c.id.label('requester_uid'),
+        packager.c.id.label('packager_uid'),
+    ]).select_from(
+        REQUEST
+        .outerjoin(requester, REQUEST.c.requester_id == requester.c.id)
+        .outerjoin(packager, REQUEST.c.packager_id == packager.c.id)
+    )
+
+
+def request_details(row):
+    """Turn a row of request_details_query into request details"""
+    result = {c.name: row[c.name] for c in REQUEST.c}
+    result['requester'] = user_brief(
+        row['requester_uid'], row['requester_username'],
+        row['requester_admin']
+    )
+    result['packager'] = user_brief(
+        row['packager_uid'], row['packager_username'],
+        row['packager_admin']
+    )
+    return result
+
+
+async def get_request_details(conn, ids):
+    """Fetch requests along with requester and packager info in a single
+    query, returns a dict of ID -> request"""
+    if not ids:
+        return dict()
+    query = request_details_query().where(REQUEST.c.id.in_(ids))
+    results = await conn.execute(query)
+    details = dict()
+    for row in await results.fetchall():
+        result = request_details(row)
+        details[result['id']] = result
+    return details
+
+
+async def get_open_request_details(conn, after_id=None, per_page=50):
+    """Fetch one page of open requests along with requester and packager
+    info ordered by ID, returns (requests, has_more). Paged like
+    get_open_requests_page."""
+    query = request_details_query().where(
+        REQUEST.c.status == RequestStatus.OPEN
+    )
+    if after_id is not None:
+        query = query.where(REQUEST.c.id > after_id)
+    query = query.order_by(REQUEST.c.id).limit(per_page + 1)
+    results = await conn.execute(query)
+    requests = [request_details(row) for row in await results.fetchall()]
+    return requests[:per_page], len(requests) > per_page
 
 
 async def get_request_detail(conn, id):
     """Not just fetch request info, but also user info"""
-    result = await get_row(conn, REQUEST, id)
-    # Get requester & packager information
-    try:
-        query = await get_row(conn, USER, result['requester_id'])
-        result['requester'] = dict(id=query['id'], username=query['username'], admin=query['admin'])
-    except Exception:
-        result['requester'] = dict(id='0', username='Unknown')
-    try:
-        await get_row(conn, USER, result['packager_id'])
-        result['packager'] = dict(id=query['id'], username=query['username'], admin=query['admin'])
-    except Exception:
-        result['packager'] = dict(id='0', username='Unknown')
-    return result
+    details = await get_request_details(conn, [id])
+    if id not in details:
+        msg = "Row with id: {} does not exists"
+        raise RecordNotFoundException(msg.format(id))
+    return details[id]
 
 
 async def new_user(conn, username, id=None, admin=False, password_hash=None):
-    """Create new user"""
+    """Create new user, returns its ID"""
     # Initializing values
-    id = id or (await get_max_id(conn, USER) + 1)
-    statement = USER.insert(None).values(
-        id=id, username=username, admin=admin,
+    values = dict(
+        username=username, admin=admin,
         password_hash=password_hash,
     )
-    await conn.execute(statement)
+    # IDs are allocated by the database unless explicitly given
+    if id is not None:
+        values['id'] = id
+    statement = USER.insert(None).values(values).returning(USER.c.id)
+    result = await conn.execute(statement)
+    return await result.scalar()
 
 
 async def get_users(conn):
@@ -92,27 +203,47 @@ async def get_requests(conn):
     return await get_rows(conn, REQUEST)
 
 
-async def search_requests(conn, keyword):
-    """Search through requests"""
-    keyword = '%{}%'.format(keyword)
-    query = select([REQUEST]).where(
-        or_(
-            REQUEST.c.name.like(keyword),
-            REQUEST.c.description.like(keyword)
-        )
-    ).order_by(REQUEST.c.id).limit(10)
-    results = await conn.execute(query, keyword=keyword)
+async def get_requests_written_since(conn, revision):
+    """Fetch ID, name, status and revision of requests written (created or
+    changed) after revision, in revision order"""
+    query = select([
+        REQUEST.c.id, REQUEST.c.name, REQUEST.c.status, REQUEST.c.revision
+    ]).where(REQUEST.c.revision > revision).order_by(REQUEST.c.revision)
+    results = await conn.execute(query)
     return await results.fetchall()
 
 
-async def get_max_user_id(conn):
-    """Fetch max user id (wrapper of get_max_id)"""
-    return await get_max_id(conn, USER)
-
-
-async def get_max_request_id(conn):
-    """Fetch max request id (wrapper of get_max_id)"""
-    return await get_max_id(conn, REQUEST)
+def escape_like(keyword):
+    """Escape LIKE wildcards in keyword"""
+    return keyword.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_')
+
+
+async def search_requests(conn, keyword, offset=0, limit=10):
+    """Search through requests, best matches first. Full-text matches on
+    name and description come from db.SEARCH_VECTOR, substring matches on
+    name from the trigram index. The description of every
+    result is returned as `headline`, with matches highlighted between
+    HIGHLIGHT_START and HIGHLIGHT_STOP."""
+    vector = SEARCH_VECTOR
+    tsquery = func.plainto_tsquery('simple', keyword)
+    rank = func.ts_rank(vector, tsquery) + \
+        func.similarity(REQUEST.c.name, keyword)
+    headline = func.ts_headline(
+        'simple', func.coalesce(REQUEST.c.description, ''), tsquery,
+        'HighlightAll=true, StartSel=%s, StopSel=%s' %
+        (HIGHLIGHT_START, HIGHLIGHT_STOP)
+    )
+    query = select([
+        REQUEST, rank.label('rank'), headline.label('headline')
+    ]).where(
+        or_(
+            vector.op('@@')(tsquery),
+            REQUEST.c.name.ilike('%{}%'.format(escape_like(keyword)))
+        )
+    ).order_by(rank.desc(), REQUEST.c.id).offset(offset).limit(limit)
+    results = await conn.execute(query)
+    return await results.fetchall()
 
 
 async def get_user(conn, id):
@@ -183,6 +314,104 @@ async def get_request(conn, id):
     return await get_row(conn, REQUEST, id)
 
 
+async def get_requests_by_ids(conn, ids, for_update=False):
+    """Fetch many requests by ID in one query, optionally locking them for
+    the rest of the transaction, returns a dict of ID -> request"""
+    if not ids:
+        return dict()
+    query = select([REQUEST]).where(REQUEST.c.id.in_(ids))
+    if for_update:
+        query = query.with_for_update()
+    results = await conn.execute(query)
+    return {r['id']: r for r in await results.fetchall()}
+
+
+async def get_open_requests_by_names(conn, keys):
+    """Fetch open requests matching any of the (type, name) pairs"""
+    if not keys:
+        return []
+    query = select([REQUEST]).where(
+        and_(
+            REQUEST.c.status == RequestStatus.OPEN,
+            tuple_(REQUEST.c.type, REQUEST.c.name).in_(keys)
+        )
+    )
+    results = await conn.execute(query)
+    return await results.fetchall()
+
+
+async def claim_next_request(conn, packager_id, newest_first=False):
+    """Claim the oldest (or newest) unclaimed open request for packager_id
+    and return it, None if there is nothing left. Rows being claimed by a
+    concurrent transaction are skipped instead of waited for."""
+    if newest_first:
+        order = (REQUEST.c.pub_date.desc(), REQUEST.c.id.desc())
+    else:
+        order = (REQUEST.c.pub_date, REQUEST.c.id)
+    candidate = select([REQUEST.c.id]).where(
+        and_(
+            REQUEST.c.status == RequestStatus.OPEN,
+            REQUEST.c.packager_id.is_(None)
+        )
+    ).order_by(*order).limit(1).with_for_update(skip_locked=True)
+    query = REQUEST.update(None).where(
+        REQUEST.c.id == candidate.as_scalar()
+    ).values(packager_id=packager_id).returning(*REQUEST.c)
+    results = await conn.execute(query)
+    return await results.fetchone()
+
+
+async def get_requests_batch(conn, after_id=None, limit=500, status=None,
+                             rtype=None, requester_id=None):
+    """Fetch up to limit requests with ID above after_id, ordered by ID,
+    optionally filtered by status, type and requester"""
+    query = select([REQUEST])
+    if after_id is not None:
+        query = query.where(REQUEST.c.id > after_id)
+    if status is not None:
+        query = query.where(REQUEST.c.status == status)
+    if rtype is not None:
+        query = query.where(REQUEST.c.type == rtype)
+    if requester_id is not None:
+        query = query.where(REQUEST.c.requester_id == requester_id)
+    query = query.order_by(REQUEST.c.id).limit(limit)
+    results = await conn.execute(query)
+    return await results.fetchall()
+
+
+async def get_revision(conn):
+    """Current revision of requests and users and when it was made, as
+    (revision, updated_at, settled)
+
+    Every written row takes the next revision of revision_seq, the current
+    revision is the greatest committed one. A transaction in progress may
+    still commit an older revision, so the revision is only settled if no
+    transaction holds REVISION_LOCK. It is tried without waiting, writers
+    only wait for it while the revision is read."""
+    latest = union_all(*[
+        select([table.c.revision, column.label('updated_at')])
+        .order_by(table.c.revision.desc()).limit(1)
+        for table, column in (
+            (REQUEST, REQUEST.c.updated_at),
+            (USER, USER.c.updated_at),
+            (REVISION_TOMBSTONE, REVISION_TOMBSTONE.c.deleted_at)
+        )
+    ]).alias('latest')
+    async with conn.begin():
+        results = await conn.execute(
+            select([func.pg_try_advisory_xact_lock(REVISION_LOCK)])
+        )
+        settled = await results.scalar()
+        # Read after the lock is taken, so nothing older can be committed
+        results = await conn.execute(
+            select([latest]).order_by(latest.c.revision.desc()).limit(1)
+        )
+        row = await results.fetchone()
+    if row is None:
+        return 0, datetime.fromtimestamp(0, timezone.utc), settled
+    return row['revision'], row['updated_at'], settled
+
+
 async def get_requests_by_user(conn, id):
     """Fetch all the requests that are requested by user"""
     query = select([REQUEST]).where(REQUEST.c.requester_id == id)
@@ -190,14 +419,32 @@ async def get_requests_by_user(conn, id):
     return await results.fetchall()
 
 
-async def update_user(conn, id, **kwargs):
+async def update_user(conn, id, where=None, **kwargs):
     """Update user by ID (wrapper of update_row)"""
-    await update_row(conn, USER, id, kwargs)
+    return await update_row(conn, USER, id, kwargs, where=where)
 
 
-async def update_request(conn, id, **kwargs):
+async def update_request(conn, id, where=None, **kwargs):
     """Update request by ID (wrapper of update_row)"""
-    await update_row(conn, REQUEST, id, kwargs)
+    return await update_row(conn, REQUEST, id, kwargs, where=where)
+
+
+async def update_requests(conn, ids, where=None, **kwargs):
+    """Update many requests with the same values (wrapper of update_rows)"""
+    return await update_rows(conn, REQUEST, ids, kwargs, where=where)
+
+
+async def get_open_request(conn, rtype, name):
+    """Get the open request of given type for a package, if any"""
+    query = select([REQUEST]).where(
+        and_(
+            REQUEST.c.status == RequestStatus.OPEN,
+            REQUEST.c.type == rtype,
+            REQUEST.c.name == name
+        )
+    ).limit(1)
+    results = await conn.execute(query)
+    return await results.fetchone()
 
 
 async def get_open_requests(conn):
@@ -207,6 +454,56 @@ async def get_open_requests(conn):
     return await results.fetchall()
 
 
+async def get_open_requests_page(conn, after_id=None, per_page=10):
+    """Fetch one page of open requests ordered by ID, returns (requests,
+    has_more). Pass the last ID of the previous page as after_id for the
+    next page, pages never skip or repeat requests closed meanwhile."""
+    query = select([REQUEST]).where(REQUEST.c.status == RequestStatus.OPEN)
+    if after_id is not None:
+        query = query.where(REQUEST.c.id > after_id)
+    # One extra row tells whether there is a next page
+    query = query.order_by(REQUEST.c.id).limit(per_page + 1)
+    results = await conn.execute(query)
+    requests = await results.fetchall()
+    return requests[:per_page], len(requests) > per_page
+
+
+# Web session related functions
+
+
+async def get_web_session(conn, id):
+    """Get data of an unexpired web session, None if there is none"""
+    query = select([WEB_SESSION.c.data]).where(
+        and_(WEB_SESSION.c.id == id, WEB_SESSION.c.expires > func.now())
+    )
+    results = await conn.execute(query)
+    return await results.scalar()
+
+
+async def save_web_session(conn, id, data, expires):
+    """Create or replace a web session"""
+    statement = insert(WEB_SESSION).values(id=id, data=data, expires=expires)
+    statement = statement.on_conflict_do_update(
+        index_elements=[WEB_SESSION.c.id],
+        set_=dict(data=statement.excluded.data,
+                  expires=statement.excluded.expires)
+    )
+    await conn.execute(statement)
+
+
+async def delete_web_session(conn, id):
+    """Delete a web session"""
+    await conn.execute(WEB_SESSION.delete().where(WEB_SESSION.c.id == id))
+
+
+async def delete_expired_web_sessions(conn):
+    """Delete expired web sessions, returns how many were deleted"""
+    results = await conn.execute(
+        WEB_SESSION.delete().where(WEB_SESSION.c.expires <= func.now())
+    )
+    return results.rowcount
+
+
 # Daemon part
 class Daemon(object):
     """Maintenance daemon"""
@@ -216,45 +513,86 @@ class Daemon(object):
         self.app['config'] = config
 
     async def init_db(self):
-        """Initialize database connection"""
+        """Initialize database connection and packages site client"""
         await init_db(self.app)
+        await init_packages(self.app)
+
+    async def close(self):
+        """Close database connection and packages site client"""
+        await close_packages(self.app)
+        await close_db(self.app)
+
+    async def apply(self, results):
+        """Write sweep results back to database in one transaction, one
+        UPDATE per (status, note) group and batch, returns IDs of the
+        requests closed (not those closed by someone else meanwhile)"""
+        groups = dict()
+        for id, status, note in results:
+            groups.setdefault((status, note), []).append(id)
+        batch_size = self.app['config']['daemon']['batch_size']
+        closed = []
+        async with self.app['db'].acquire() as conn:
+            async with conn.begin():
+                for (status, note), ids in groups.items():
+                    for i in range(0, len(ids), batch_size):
+                        closed += await update_requests(
+                            conn, ids[i:i + batch_size],
+                            where=(REQUEST.c.status == RequestStatus.OPEN),
+                            status=status, note=note
+                        )
+        return closed
 
     async def clean(self):
         """Cleanup finished requests"""
         logger.info('Start cleaning...')
+        conf = self.app['config']['daemon']
+        packages = self.app['packages']
+        started = time.monotonic()
+        if conf['mode'] == 'snapshot':
+            try:
+                packages = await packages.get_index()
+            except Exception as e:
+                logger.warning('Unable to fetch packages site snapshot, '
+                               'falling back to queries: %s' % e)
+                packages = self.app['packages']
         async with self.app['db'].acquire() as conn:
             requests = await get_open_requests(conn)
-            for request in requests:
+        semaphore = asyncio.Semaphore(conf['concurrency'])
+
+        async def process(request):
+            async with semaphore:
                 logger.debug('Processing %s (ID: %s)...' %
                              (request['name'], request['id']))
-                if request['type'] == RequestType.PAKREQ:
-                    if await find_package(request['name']):
-                        logger.info('%s has been packaged, closing' %
-                                    request['name'])
-                        await update_request(
-                            conn, request['id'], status=RequestStatus.DONE,
-                            note='(BOT) This package has been packaged.'
-                        )
-                elif request['type'] == RequestType.UPDREQ:
-                    if await find_package(request['name']):
-                        info = await get_package_info(request['name'])
-                        if version.parse(info['pkg']['version']) >= version.parse(request['description']):
-                            logger.info(
-                                '%s has been upgraded, closing...' % request['name'])
-                            await update_request(
-                                conn, request['id'], status=RequestStatus.DONE,
-                                note='(BOT) This package has been updated to: %s' % info[
-                                    'pkg']['version']
-                            )
-                    else:
-                        await update_request(
-                            conn, request['id'], status=RequestStatus.REJECTED,
-                            note='404 Package not found'
-                        )
+                try:
+                    return request, await check_request(packages, request)
+                except Exception as e:
+                    logger.warning('Unable to check %s (ID: %s): %s' %
+                                   (request['name'], request['id'], e))
+                    return request, None
+
+        results = []
+        for future in asyncio.as_completed([process(r) for r in requests]):
+            request, result = await future
+            if result is None:
+                continue
+            logger.info('%s (ID: %s): %s' %
+                        (request['name'], request['id'], result[1]))
+            results.append((request['id'], ) + result)
+        closed = await self.apply(results)
+        async with self.app['db'].acquire() as conn:
+            sessions = await delete_expired_web_sessions(conn)
+        logger.info('Purged %s expired web sessions' % sessions)
+        logger.info('Swept %s open requests in %.2fs, %s closed' %
+                    (len(requests), time.monotonic() - started,
+                     len(closed)))
+        logger.info('Packages site cache: %s' %
+                    self.app['packages'].cache.stats())
+        logger.info('Database pool: %s' % self.app['db'].stats())
 
     def start(self):
         scheduler = AsyncIOScheduler()
-        scheduler.add_job(self.clean, 'interval', seconds=1800,
+        scheduler.add_job(self.clean, 'interval',
+                          seconds=self.app['config']['daemon']['interval'],
                           next_run_time=datetime.now())
         scheduler.start()
 
@@ -269,3 +607,5 @@ def start_daemon(config):
         loop.run_forever()
     except (KeyboardInterrupt, SystemExit):
         pass
+    finally:
+        loop.run_until_complete(daemon.close())
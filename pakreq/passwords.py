@@ -0,0 +1,89 @@
+# passwords.py
+
+"""
+Password hashing off the event loop
+"""
+
+import time
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pakreq.utils import password_hash, password_verify
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordService(object):
+    """Runs Argon2 hashing and verification in a bounded thread pool, at
+    most `workers` of them at a time (each may take 64 MiB of memory)"""
+
+    def __init__(self, workers=2, slow_wait=1.0):
+        self.workers = workers
+        self.slow_wait = slow_wait
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='argon2'
+        )
+        self.semaphore = None
+        # Queue-time metrics
+        self.waiting = 0
+        self.jobs = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, func, *args):
+        """Run func(*args) in the pool, waiting for a free worker first"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.workers)
+        queued = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            wait = time.monotonic() - queued
+            self.jobs += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if wait > self.slow_wait:
+                logger.warning('Password hashing queued for %.2fs' % wait)
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor, func, *args
+            )
+        finally:
+            self.semaphore.release()
+
+    async def hash(self, id, password):
+        """Calculate password hash (see utils.password_hash)"""
+        return await self.run(password_hash, id, password)
+
+    async def verify(self, id, password, hash):
+        """Verify password hash (see utils.password_verify)"""
+        return await self.run(password_verify, id, password, hash)
+
+    def stats(self):
+        """Queue-time statistics"""
+        return dict(
+            workers=self.workers, waiting=self.waiting, jobs=self.jobs,
+            wait_avg=(self.wait_total / self.jobs if self.jobs else 0.0),
+            wait_max=self.wait_max
+        )
+
+    def close(self):
+        """Shut the pool down"""
+        self.executor.shutdown(wait=False)
+
+
+async def init_passwords(app):
+    """Initialize password hashing service"""
+    conf = app['config']['passwords']
+    app['passwords'] = PasswordService(
+        workers=conf['workers'], slow_wait=conf['slow_wait']
+    )
+
+
+async def close_passwords(app):
+    """Close password hashing service"""
+    app['passwords'].close()
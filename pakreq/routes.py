@@ -5,13 +5,11 @@ Routes
 """
 
 import pathlib
-from cryptography.fernet import Fernet
-import base64
 from aiohttp_session import setup as setup_session
 from aiohttp_security import setup as setup_security
 from aiohttp_security import SessionIdentityPolicy
-from aiohttp_session.cookie_storage import EncryptedCookieStorage
 
+from pakreq.sessions import session_storage
 from pakreq.views import (
     index, requests_all, request_detail, detail, login, auth, account, logout)
 from pakreq.webauth import PakreqAuth
@@ -21,15 +19,13 @@ PROJECT_ROOT = pathlib.Path(__file__).parent
 
 def setup_routes(app):
     """Setup routes and session handlers"""
-    # we could use `secret` module here but that requires Python 3.6+
-    key = base64.urlsafe_b64decode(Fernet.generate_key())
-    setup_session(app, EncryptedCookieStorage(key))
+    setup_session(app, session_storage(app))
     setup_security(app, SessionIdentityPolicy(), PakreqAuth(app))
     # RESTful API
     app.router.add_get('/requests', requests_all)
-    app.router.add_get('/request/{ids:([0-9]*)}', request_detail)
+    app.router.add_get('/request/{ids:[0-9]+(?:,[0-9]+)*}', request_detail)
     # Pages
-    app.router.add_get('/detail/{ids:([0-9]*)}', detail)
+    app.router.add_get('/detail/{ids:[0-9]+(?:,[0-9]+)*}', detail)
     app.router.add_get('/', index)
     app.router.add_get('/login', login)
     app.router.add_post('/login', auth)
@@ -0,0 +1,94 @@
+# sessions.py
+
+"""
+Web session storage
+"""
+
+import base64
+import logging
+import secrets
+
+from datetime import datetime, timedelta, timezone
+
+from aiohttp_session import AbstractStorage, Session
+from aiohttp_session.cookie_storage import EncryptedCookieStorage
+from cryptography.fernet import Fernet
+
+from pakreq.cache import TTLCache
+from pakreq.pakreq import (
+    get_web_session, save_web_session, delete_web_session
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseStorage(AbstractStorage):
+    """Sessions kept in the web_session table, the cookie only holds a
+    random session ID. Sessions are cached for cache_ttl seconds, so most
+    requests neither touch the database nor decrypt anything."""
+
+    def __init__(self, app, cache_size=1024, cache_ttl=60, **kwargs):
+        super().__init__(**kwargs)
+        self.app = app
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl,
+                              negative_ttl=0)
+
+    async def load_session(self, request):
+        key = self.load_cookie(request)
+        if not key:
+            return await self.new_session()
+
+        async def fetch():
+            async with self.app['db'].acquire() as conn:
+                return await get_web_session(conn, key)
+        data = await self.cache.get_or_fetch(key, fetch)
+        if data is None:
+            return await self.new_session()
+        try:
+            data = self._decoder(data)
+        except ValueError:
+            return await self.new_session()
+        return Session(key, data=data, new=False, max_age=self.max_age)
+
+    async def save_session(self, request, response, session):
+        key = session.identity
+        # The session was replaced (see aiohttp_session.new_session), the
+        # one of the cookie must not be usable any more
+        old_key = self.load_cookie(request)
+        async with self.app['db'].acquire() as conn:
+            if old_key and old_key != key:
+                self.cache.invalidate(old_key)
+                await delete_web_session(conn, old_key)
+            if session.empty:
+                if key is not None:
+                    self.cache.invalidate(key)
+                    await delete_web_session(conn, key)
+                self.save_cookie(response, '', max_age=session.max_age)
+                return
+            if key is None:
+                key = secrets.token_urlsafe(32)
+            data = self._encoder(self._get_session_data(session))
+            expires = datetime.now(timezone.utc) + \
+                timedelta(seconds=session.max_age)
+            await save_web_session(conn, key, data, expires)
+        self.cache.set(key, data)
+        self.save_cookie(response, key, max_age=session.max_age)
+
+
+def session_storage(app):
+    """Session storage configured in web.session_store"""
+    conf = app['config']['web']
+    if conf['session_store'] == 'database':
+        return DatabaseStorage(
+            app, cache_size=conf['session_cache_size'],
+            cache_ttl=conf['session_cache_ttl'],
+            max_age=conf['session_max_age']
+        )
+    key = conf['session_key']
+    if key is None:
+        logger.warning('web.session_key is not set, sessions will not '
+                       'survive a restart')
+        key = Fernet.generate_key()
+    return EncryptedCookieStorage(
+        base64.urlsafe_b64decode(key), max_age=conf['session_max_age']
+    )
@@ -4,6 +4,8 @@
 Settings (Configurations)
 """
 
+import os
+import logging
 import argparse
 import pathlib
 
@@ -15,6 +17,8 @@ from pakreq.utils import TRAFARET
 BASE_DIR = pathlib.Path(__file__).parent.parent
 DEFAULT_CONFIG_PATH = BASE_DIR / 'config' / 'pakreq.yaml'
 
+logger = logging.getLogger(__name__)
+
 
 def get_config(argv=None):
     """Read and parse configuration"""
@@ -29,3 +33,14 @@ def get_config(argv=None):
 
     config = commandline.config_from_options(options, TRAFARET)
     return config
+
+
+def get_web_workers(config):
+    """Number of web worker processes, one per CPU unless configured, at
+    most one per connection of db.maxsize"""
+    workers = config['web']['workers']
+    maxsize = config['db']['maxsize']
+    if workers > maxsize:
+        logger.warning('web.workers is %s but db.maxsize is %s, starting '
+                       '%s workers' % (workers, maxsize, maxsize))
+    return min(workers or os.cpu_count() or 1, maxsize)
@@ -7,20 +7,36 @@ Telegram bot
 import asyncio
 import logging
 
+from aiohttp import web
 from aiogram import Bot, types
 from aiogram.utils import executor
 from aiogram.dispatcher import Dispatcher
 
 import pakreq.db
+import pakreq.fuzzy
 import pakreq.pakreq
+import pakreq.packages
+import pakreq.passwords
 import pakreq.telegram_consts
+import pakreq.webhook
 
-from pakreq.utils import get_type, get_status, password_hash, password_verify, escape
+from pakreq.utils import (
+    get_type, get_status, escape, highlight
+)
 from pakreq.db import OAuthType
+from pakreq.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 
+def unique_ids(args):
+    """Request IDs given as command arguments, without duplicates (also
+    ones spelled differently, like 5 and 05), in their original order"""
+    return list(dict.fromkeys(
+        str(int(arg)) if arg.isdigit() else arg for arg in args
+    ))
+
+
 class PakreqBot(object):
     """pakreqBot main object"""
 
@@ -29,12 +45,90 @@ class PakreqBot(object):
         self.app['config'] = config
         self.bot = Bot(token=self.app['config']['telegram']['token'])
         self.dp = Dispatcher(self.bot)
+        self.names = pakreq.fuzzy.TrigramIndex()
+        # Requests written up to this revision are in self.names
+        self.names_revision = 0
+        conf = self.app['config']['telegram']
+        self.identities = TTLCache(
+            maxsize=conf['identity_cache_size'],
+            ttl=conf['identity_cache_ttl'],
+            negative_ttl=conf['identity_cache_negative_ttl']
+        )
 
     async def init_db(self):
-        """Init database connection"""
+        """Init database connection and packages site client"""
         await pakreq.db.init_db(self.app)
+        await pakreq.packages.init_packages(self.app)
+        await pakreq.passwords.init_passwords(self.app)
+        await self.build_name_index()
+
+    async def build_name_index(self):
+        """(Re)build the in-memory index of open request names"""
+        self.names = pakreq.fuzzy.TrigramIndex()
+        self.names_revision = 0
+        await self.refresh_name_index()
+        logger.info(
+            'Indexed %s request names, using about %s KiB' %
+            (len(self.names), self.names.memory_usage() // 1024)
+        )
+
+    async def refresh_name_index(self):
+        """Catch up with requests written since the index was last
+        refreshed, by any process (other web workers, the daemon)"""
+        async with self.app['db'].acquire() as conn:
+            revision, _, settled = await pakreq.pakreq.get_revision(conn)
+            requests = await pakreq.pakreq.get_requests_written_since(
+                conn, self.names_revision
+            )
+        for request in requests:
+            if request['status'] == pakreq.db.RequestStatus.OPEN:
+                self.names.add(request['id'], request['name'])
+            else:
+                self.names.remove(request['id'])
+        # Older revisions may still be committed unless settled, they are
+        # read again next time
+        if settled:
+            self.names_revision = revision
+
+    async def similar_requests(self, name, exclude=None):
+        """Format open requests with names similar to name"""
+        await self.refresh_name_index()
+        return ''.join(
+            pakreq.telegram_consts.SIMILAR_REQUEST.format(
+                id=id, name=escape(similar)
+            )
+            for id, similar, _ in self.names.search(name)
+            if id != exclude
+        )
+
+    async def shutdown(self, *args):
+        """Close packages site client and database connection"""
+        await pakreq.packages.close_packages(self.app)
+        await pakreq.passwords.close_passwords(self.app)
+        await pakreq.db.close_db(self.app)
 
     # Helper functions
+    async def get_user(self, conn, telegram_id):
+        """Get the pakreq user linked to a Telegram ID (None if there is
+        none), served from the identity cache when possible"""
+        async def fetch():
+            user = await pakreq.pakreq.get_user_from_oauth_id(
+                conn, OAuthType.Telegram, telegram_id)
+            if user is None:
+                return None
+            return dict(
+                id=user['id'], username=user['username'], admin=user['admin']
+            )
+        return await self.identities.get_or_fetch(telegram_id, fetch)
+
+    def invalidate_identity(self, telegram_id=None):
+        """Forget cached identities, call this after changing how Telegram
+        IDs map to users or what those users are (e.g. admin status)"""
+        if telegram_id is None:
+            self.identities.clear()
+        else:
+            self.identities.invalidate(telegram_id)
+
     @staticmethod
     async def check_arguments(message, splitted, condition, notification):
         if condition(len(splitted)):
@@ -69,7 +163,7 @@ class PakreqBot(object):
             if not user:
                 await reply_invalid_cred()
                 return
-            if not password_verify(
+            if not await self.app['passwords'].verify(
                     user['id'], splitted[2], user['password_hash']):
                 await reply_invalid_cred()
                 return
@@ -100,6 +194,8 @@ class PakreqBot(object):
                     ),
                     parse_mode='HTML'
                 )
+            # Only once written, or a concurrent lookup caches the old link
+            self.invalidate_identity(message.from_user.id)
             await message.reply(
                 pakreq.telegram_consts.LINK_SUCCESS.format(
                     username=splitted[1]
@@ -114,10 +210,7 @@ class PakreqBot(object):
             message.from_user.id
         )
         async with self.app['db'].acquire() as conn:
-            if not await \
-                pakreq.pakreq.get_user_from_oauth_id(conn,
-                                                     OAuthType.Telegram,
-                                                     message.from_user.id):
+            if not await self.get_user(conn, message.from_user.id):
                 await message.reply(
                                 pakreq.telegram_consts.UNLINK_NOTHING_TO_UNLINK
                                 )
@@ -126,6 +219,7 @@ class PakreqBot(object):
             try:
                 await pakreq.pakreq.delete_oauth(conn, OAuthType.Telegram,
                                                  message.from_user.id)
+                self.invalidate_identity(message.from_user.id)
                 await message.reply(pakreq.telegram_consts.UNLINK_SUCCESS)
             except Exception:
                 await message.reply(
@@ -141,54 +235,69 @@ class PakreqBot(object):
         logger.info('Received request to list requests: %s' % message.text)
         splitted = message.text.split()
         result = ''
-        if len(splitted) == 1:
+        if len(splitted) == 1 or (
+                len(splitted) == 3 and splitted[1] == 'after'):
             if message.chat.id < 0:
                 await message.reply(
                     pakreq.telegram_consts.FULL_LIST_PRIVATE_ONLY,
                     parse_mode='HTML'
                 )
                 return
+            after_id = None
+            if len(splitted) == 3:
+                if not splitted[2].isdigit():
+                    await message.reply(
+                        pakreq.telegram_consts.INVALID_REQUEST,
+                        parse_mode='HTML'
+                    )
+                    return
+                after_id = int(splitted[2])
             async with self.app['db'].acquire() as conn:
-                requests = await pakreq.pakreq.get_open_requests(conn)
-            for request in requests[:10]:
-                if request['status'] == pakreq.db.RequestStatus.OPEN:
-                    result = result + \
-                        pakreq.telegram_consts.REQUEST_BRIEF_INFO.format(
-                            id=request['id'], name=escape(
-                                request['name']),
-                            rtype=get_type(request['type']),
-                            description=escape(request['description'])
-                        )
-            if len(requests) >= 10:
+                requests, has_more = \
+                    await pakreq.pakreq.get_open_requests_page(
+                        conn, after_id=after_id, per_page=10
+                    )
+            for request in requests:
+                result = result + \
+                    pakreq.telegram_consts.REQUEST_BRIEF_INFO.format(
+                        id=request['id'], name=escape(
+                            request['name']),
+                        rtype=get_type(request['type']),
+                        description=escape(request['description'])
+                    )
+            if has_more:
+                result += pakreq.telegram_consts.NEXT_PAGE.format(
+                    id=requests[-1]['id']
+                )
                 result += pakreq.telegram_consts.FULL_LIST.format(
                     url=self.app['config']['base_url']
                 )
             if result == '':
                 result = pakreq.telegram_consts.NO_PENDING_REQUESTS
         elif len(splitted) <= 6:
+            ids = [int(id) for id in splitted[1:] if id.isdigit()]
             async with self.app['db'].acquire() as conn:
-                for id in splitted[1:]:
-                    try:
-                        request = await pakreq.pakreq.get_request_detail(
-                            conn, int(id)
+                requests = await pakreq.pakreq.get_request_details(conn, ids)
+            for id in splitted[1:]:
+                request = requests.get(int(id)) if id.isdigit() else None
+                if request is None:
+                    result += \
+                        pakreq.telegram_consts.REQUEST_NOT_FOUND.format(
+                            id=escape(id)
                         )
-                        result += pakreq.telegram_consts.REQUEST_DETAIL.format(
-                            name=escape(request['name']),
-                            id=request['id'],
-                            status=get_status(request['status']),
-                            rtype=get_type(request['type']),
-                            desc=escape(request['description']),
-                            req_name=escape(request['requester']['username']),
-                            req_id=request['requester']['id'],
-                            pak_name=escape(request['packager']['username']),
-                            pak_id=request['packager']['id'],
-                            date=request['pub_date'].isoformat(),
-                            eta=(request['note'] or 'Empty'))
-                    except (pakreq.db.RecordNotFoundException, ValueError):
-                        result += \
-                            pakreq.telegram_consts.REQUEST_NOT_FOUND.format(
-                                id=id
-                            )
+                    continue
+                result += pakreq.telegram_consts.REQUEST_DETAIL.format(
+                    name=escape(request['name']),
+                    id=request['id'],
+                    status=get_status(request['status']),
+                    rtype=get_type(request['type']),
+                    desc=escape(request['description']),
+                    req_name=escape(request['requester']['username']),
+                    req_id=request['requester']['id'],
+                    pak_name=escape(request['packager']['username']),
+                    pak_id=request['packager']['id'],
+                    date=request['pub_date'].isoformat(),
+                    eta=(request['note'] or 'Empty'))
         else:
             result = pakreq.telegram_consts.TOO_MANY_ARUGMENTS
         await message.reply(result, parse_mode='HTML')
@@ -207,9 +316,8 @@ class PakreqBot(object):
         if len(splitted) == 3:
             note = splitted[2]
         async with self.app['db'].acquire() as conn:
-            user = await pakreq.pakreq.get_user_from_oauth_id(
-                conn, OAuthType.Telegram, message.from_user.id)
-            user_id = user['id']
+            user = await self.get_user(conn, message.from_user.id)
+            user_id = user and user['id']
             if user_id is None:
                 await message.reply(
                     pakreq.telegram_consts.REGISTER_FIRST,
@@ -217,8 +325,15 @@ class PakreqBot(object):
                 )
                 return
             try:
-                request = await pakreq.pakreq.get_request(conn, int(splitted[1]))
-                if request['packager_id'] != user_id:
+                try:
+                    await pakreq.pakreq.update_request(
+                        conn, int(splitted[1]),
+                        where=(pakreq.db.REQUEST.c.packager_id == user_id),
+                        note=note
+                    )
+                except pakreq.db.RecordNotFoundException:
+                    # Either there is no such request or it isn't ours
+                    await pakreq.pakreq.get_request(conn, int(splitted[1]))
                     await message.reply(
                         pakreq.telegram_consts.CLAIM_FIRST.format(
                             id=int(splitted[1])
@@ -226,9 +341,6 @@ class PakreqBot(object):
                         parse_mode='HTML'
                     )
                     return
-                await pakreq.pakreq.update_request(
-                    conn, int(splitted[1]), note=note
-                )
                 await message.reply(
                     pakreq.telegram_consts.PROCESS_SUCCESS.format(
                         id=splitted[1]
@@ -268,11 +380,10 @@ class PakreqBot(object):
         ):
             return
         async with self.app['db'].acquire() as conn:
-            user = await pakreq.pakreq.get_user_from_oauth_id(
-                conn, OAuthType.Telegram, message.from_user.id)
-            user_id = user['id']
+            user = await self.get_user(conn, message.from_user.id)
+            user_id = user and user['id']
             if user_id is not None:
-                pw = password_hash(
+                pw = await self.app['passwords'].hash(
                     user_id,
                     splitted[1]
                 )
@@ -307,19 +418,40 @@ class PakreqBot(object):
                 pakreq.telegram_consts.INVALID_REQUEST
         ):
             return
+        # /search page <n> <keyword> for results after the first page
+        page = 1
+        paged = splitted[1].split(maxsplit=2)
+        if len(paged) == 3 and paged[0] == 'page' and paged[1].isdigit():
+            page = max(1, int(paged[1]))
+            splitted[1] = paged[2]
+        per_page = 10
         async with self.app['db'].acquire() as conn:
-            requests = await pakreq.pakreq.search_requests(conn, splitted[1])
+            # One extra row tells whether there is a next page
+            requests = await pakreq.pakreq.search_requests(
+                conn, splitted[1], offset=(page - 1) * per_page,
+                limit=per_page + 1
+            )
+        has_more = len(requests) > per_page
         results = ''
-        for request in requests:
+        for request in requests[:per_page]:
             results += pakreq.telegram_consts.REQUEST_BRIEF_INFO.format(
                 id=request['id'], name=escape(request['name']),
                 rtype=get_type(request['type']),
-                description=escape(request['description']).replace(
-                    escape(splitted[1]), '<b>%s</b>' % escape(splitted[1])
+                description=highlight(request['headline'] or 'N/A')
+            )
+        if not results:
+            results = pakreq.telegram_consts.NO_MATCH_FOUND.format(
+                keyword=escape(splitted[1])
+            )
+            suggestions = await self.similar_requests(splitted[1])
+            if suggestions:
+                results += pakreq.telegram_consts.DID_YOU_MEAN.format(
+                    requests=suggestions
                 )
+        if has_more:
+            results += pakreq.telegram_consts.MORE_RESULTS.format(
+                page=page + 1, keyword=escape(splitted[1])
             )
-        results = results or \
-            pakreq.telegram_consts.NO_MATCH_FOUND.format(keyword=splitted[1])
         await message.reply(
             pakreq.telegram_consts.SEARCH_RESULT.format(
                 matches=results
@@ -331,8 +463,7 @@ class PakreqBot(object):
         """Implementation of /whoami, get user info"""
         logger.info('Received request to show who that is: %s' % message.text)
         async with self.app['db'].acquire() as conn:
-            user = await pakreq.pakreq.get_user_from_oauth_id(
-                conn, OAuthType.Telegram, message.from_user.id)
+            user = await self.get_user(conn, message.from_user.id)
         if user:
             await message.reply(
                 pakreq.telegram_consts.WHOAMI.format(
@@ -358,40 +489,44 @@ class PakreqBot(object):
             else:
                 pw = None
         else:
-            username = message.from_user.username or message.from_user.id
+            username = str(message.from_user.username or message.from_user.id)
             pw = None
         async with self.app['db'].acquire() as conn:
-            users = await pakreq.pakreq.get_users(conn)
-            for user in users:
-                if await pakreq.pakreq.get_oauth_from_oid(
-                        conn, OAuthType.Telegram, message.from_user.id):
-                    await message.reply(
-                        pakreq.telegram_consts.ALREADY_REGISTERED,
-                        parse_mode='HTML'
-                    )
-                    return
-                if user['username'] == username:
-                    await message.reply(
-                        pakreq.telegram_consts.USERNAME_ALREADY_TAKEN.format(
-                            username=escape(username)
-                        ),
-                        parse_mode='HTML'
-                    )
-                    return
-
-            user_id = await pakreq.pakreq.get_max_user_id(conn)
-            user_id += 1
-            if pw is not None:
-                pw = password_hash(user_id, pw)
-            try:
-                await pakreq.pakreq.new_user(
-                    conn, username=username,
-                    password_hash=pw
+            if await pakreq.pakreq.get_oauth_from_oid(
+                    conn, OAuthType.Telegram, message.from_user.id):
+                await message.reply(
+                    pakreq.telegram_consts.ALREADY_REGISTERED,
+                    parse_mode='HTML'
                 )
-                await pakreq.pakreq.new_oauth_from_user_id(
-                    conn, uid=user_id, type=OAuthType.Telegram,
-                    oid=message.from_user.id
+                return
+            if await pakreq.pakreq.get_user_by_name(conn, username):
+                await message.reply(
+                    pakreq.telegram_consts.USERNAME_ALREADY_TAKEN.format(
+                        username=escape(username)
+                    ),
+                    parse_mode='HTML'
                 )
+                return
+
+            try:
+                async with conn.begin():
+                    user_id = await pakreq.pakreq.new_user(
+                        conn, username=username
+                    )
+                    await pakreq.pakreq.new_oauth_from_user_id(
+                        conn, uid=user_id, type=OAuthType.Telegram,
+                        oid=message.from_user.id
+                    )
+                self.invalidate_identity(message.from_user.id)
+                # The hash is salted with the ID, which is only known
+                # once the database has allocated it
+                if pw is not None:
+                    await pakreq.pakreq.update_user(
+                        conn, user_id,
+                        password_hash=await self.app['passwords'].hash(
+                            user_id, pw
+                        )
+                    )
                 await message.reply(
                     pakreq.telegram_consts.REGISGER_SUCCESS.format(
                         username=escape(username)
@@ -424,9 +559,8 @@ class PakreqBot(object):
         if len(splitted) == 3:
             desc = splitted[2]
         async with self.app['db'].acquire() as conn:
-            user = await pakreq.pakreq.get_user_from_oauth_id(
-                conn, OAuthType.Telegram, message.from_user.id)
-            user_id = user['id']
+            user = await self.get_user(conn, message.from_user.id)
+            user_id = user and user['id']
             if user_id is None:
                 await message.reply(
                     pakreq.telegram_consts.REGISTER_FIRST,
@@ -434,8 +568,15 @@ class PakreqBot(object):
                 )
                 return
             try:
-                request = await pakreq.pakreq.get_request(conn, int(splitted[1]))
-                if request['requester_id'] != user_id:
+                try:
+                    await pakreq.pakreq.update_request(
+                        conn, int(splitted[1]),
+                        where=(pakreq.db.REQUEST.c.requester_id == user_id),
+                        description=desc
+                    )
+                except pakreq.db.RecordNotFoundException:
+                    # Either there is no such request or it isn't ours
+                    await pakreq.pakreq.get_request(conn, int(splitted[1]))
                     await message.reply(
                         pakreq.telegram_consts.ONLY_REQUESTER_CAN_EDIT.format(
                             id=int(splitted[1])
@@ -443,9 +584,6 @@ class PakreqBot(object):
                         parse_mode='HTML'
                     )
                     return
-                await pakreq.pakreq.update_request(
-                    conn, int(splitted[1]), description=desc
-                )
                 await message.reply(
                     pakreq.telegram_consts.PROCESS_SUCCESS.format(
                         id=splitted[1]
@@ -476,61 +614,97 @@ class PakreqBot(object):
             claim = True
         else:
             claim = False
-        result = ''
-        ids = None
+        if not claim and len(splitted) < 2:
+            await message.reply(
+                pakreq.telegram_consts.TOO_FEW_ARGUMENTS, parse_mode='HTML'
+            )
+            return
         async with self.app['db'].acquire() as conn:
-            if len(splitted) < 2:
-                requests = await pakreq.pakreq.get_open_requests(conn)
-                for request in requests:
-                    if (request['packager_id'] == 0):
-                        ids = [request['id']]
-                        break
-                if ids is None:
-                    await message.reply(
-                        pakreq.telegram_consts.NO_PENDING_REQUESTS,
-                        parse_mode='HTML'
-                    )
-                    return
-            else:
-                ids = splitted[1:]
-            user = await pakreq.pakreq.get_user_from_oauth_id(
-                conn, OAuthType.Telegram, message.from_user.id)
-            user_id = user['id']
+            user = await self.get_user(conn, message.from_user.id)
+            user_id = user and user['id']
             if user_id is None:
                 await message.reply(
                     pakreq.telegram_consts.REGISTER_FIRST,
                     parse_mode='HTML'
                 )
                 return
-            for request_id in ids:
-                new_user_id = user_id
-                try:
-                    request = await pakreq.pakreq.get_request(conn, int(request_id))
-                    if not claim:
-                        if user_id != request['packager_id']:
-                            result += pakreq.telegram_consts.CLAIM_FIRST \
-                                .format(
-                                    id=id
-                                )
-                            continue
-                        else:
-                            new_user_id = None
-                    await pakreq.pakreq.update_request(
-                        conn, int(request_id),
-                        packager_id=new_user_id
-                    )
-                    result += pakreq.telegram_consts.ACTION_SUCCESSFUL.format(
-                        action=splitted[0].split('@')[0][1:],
-                        id=request_id
+            if len(splitted) < 2:
+                request = await pakreq.pakreq.claim_next_request(
+                    conn, user_id,
+                    newest_first=(
+                        self.app['config']['telegram']['claim_order'] ==
+                        'newest'
                     )
-                except (pakreq.db.RecordNotFoundException, ValueError):
-                    result += pakreq.telegram_consts.REQUEST_NOT_FOUND.format(
-                        id=request_id
+                )
+                if request is None:
+                    result = pakreq.telegram_consts.NO_PENDING_REQUESTS
+                else:
+                    result = pakreq.telegram_consts.ACTION_SUCCESSFUL.format(
+                        action='claim', id=request['id']
                     )
+                await message.reply(result, parse_mode='HTML')
+                return
+            ids = unique_ids(splitted[1:])
+            results = dict()
+            async with conn.begin():
+                requests = await pakreq.pakreq.get_requests_by_ids(
+                    conn, [int(id) for id in ids if id.isdigit()],
+                    for_update=True
+                )
+                allowed = []
+                for request_id in ids:
+                    request = requests.get(int(request_id)) \
+                        if request_id.isdigit() else None
+                    if request is None:
+                        results[request_id] = \
+                            pakreq.telegram_consts.REQUEST_NOT_FOUND.format(
+                                id=escape(request_id)
+                            )
+                    elif not claim and request['packager_id'] != user_id:
+                        results[request_id] = \
+                            pakreq.telegram_consts.CLAIM_FIRST.format(
+                                id=request_id
+                            )
+                    else:
+                        allowed.append(request['id'])
+                        results[request_id] = \
+                            pakreq.telegram_consts.ACTION_SUCCESSFUL.format(
+                                action=splitted[0].split('@')[0][1:],
+                                id=request_id
+                            )
+                await pakreq.pakreq.update_requests(
+                    conn, allowed, packager_id=(user_id if claim else None)
+                )
+            result = ''.join(results[id] for id in ids)
         await message.reply(
             result, parse_mode='HTML'
         )
 
+    async def show_stats(self, message: types.Message):
+        """Implementation of /stats, show cache and worker statistics"""
+        logger.info('Received request to show stats: %s' % message.text)
+        async with self.app['db'].acquire() as conn:
+            user = await self.get_user(conn, message.from_user.id)
+        if not (user and user['admin']):
+            await message.reply(
+                pakreq.telegram_consts.ADMIN_ONLY, parse_mode='HTML'
+            )
+            return
+        db = self.app['db'].stats()
+        db_latency = ', '.join(
+            ('&lt;=%gms: %s' % (bound * 1000, count)) if bound is not None
+            else ('&gt;%gms: %s' % (db['histogram'][-2][0] * 1000, count))
+            for bound, count in db['histogram']
+        )
+        await message.reply(
+            pakreq.telegram_consts.STATS.format(
+                identities=self.identities.stats(),
+                passwords=self.app['passwords'].stats(),
+                db=db, db_latency=db_latency
+            ),
+            parse_mode='HTML'
+        )
+
     async def show_help(self, message: types.Message):
         """Implementation of /help, show help message"""
         logger.info('Received request to show help: %s' % message.text)
@@ -558,7 +732,6 @@ class PakreqBot(object):
                 pakreq.telegram_consts.TOO_FEW_ARGUMENTS
         ):
             return
-        result = ''
         rtype = handle_request(splitted[0])
         if rtype == -1:
             logging.error('Unexpected request type: %s' % splitted[0])
@@ -567,40 +740,67 @@ class PakreqBot(object):
             ))
             return
         async with self.app['db'].acquire() as conn:
-            user = await pakreq.pakreq.get_user_from_oauth_id(
-                conn, OAuthType.Telegram, message.from_user.id)
-            user_id = user['id']
+            user = await self.get_user(conn, message.from_user.id)
+            user_id = user and user['id']
             if user_id is None:
                 await message.reply(
                     pakreq.telegram_consts.REGISTER_FIRST,
                     parse_mode='HTML'
                 )
                 return
-            for id in splitted[1:]:
-                try:
-                    request = await pakreq.pakreq.get_request(conn, int(id))
-                    if (rtype == pakreq.db.RequestStatus.REJECTED) or \
-                            (rtype == pakreq.db.RequestStatus.DONE):
-                        packager_id = user_id
-                        if (request['status'] == pakreq.db.RequestStatus.DONE) or \
-                                (request['status'] == pakreq.db.RequestStatus.REJECTED):
-                            result += \
-                                pakreq.telegram_consts.REOPEN_FIRST.format(
-                                    id=id
-                                )
-                            continue
-                    else:
-                        packager_id = request['packager_id']
-                    await pakreq.pakreq.update_request(
-                        conn, int(id), status=rtype, packager_id=packager_id
+            ids = unique_ids(splitted[1:])
+            results = dict()
+            async with conn.begin():
+                requests = await pakreq.pakreq.get_requests_by_ids(
+                    conn, [int(id) for id in ids if id.isdigit()],
+                    for_update=True
+                )
+                if rtype == pakreq.db.RequestStatus.OPEN:
+                    # Reopening must not clash with a request of the same
+                    # type and name that is open already
+                    conflicts = await pakreq.pakreq.get_open_requests_by_names(
+                        conn, [(r['type'], r['name'])
+                               for r in requests.values()
+                               if r['status'] != pakreq.db.RequestStatus.OPEN]
                     )
-                    result += pakreq.telegram_consts.PROCESS_SUCCESS.format(
-                        id=id
+                    reopened = set(
+                        (r['type'], r['name']) for r in conflicts
                     )
-                except (pakreq.db.RecordNotFoundException, ValueError):
-                    result += pakreq.telegram_consts.REQUEST_NOT_FOUND.format(
-                        id=id
+                allowed = []
+                for id in ids:
+                    request = requests.get(int(id)) if id.isdigit() else None
+                    if request is None:
+                        results[id] = \
+                            pakreq.telegram_consts.REQUEST_NOT_FOUND.format(
+                                id=escape(id)
+                            )
+                        continue
+                    if rtype == pakreq.db.RequestStatus.OPEN:
+                        key = (request['type'], request['name'])
+                        if request['status'] != pakreq.db.RequestStatus.OPEN:
+                            if key in reopened:
+                                results[id] = pakreq.telegram_consts \
+                                    .ALREADY_OPEN.format(
+                                        id=id, name=escape(request['name'])
+                                    )
+                                continue
+                            reopened.add(key)
+                    elif request['status'] != pakreq.db.RequestStatus.OPEN:
+                        results[id] = \
+                            pakreq.telegram_consts.REOPEN_FIRST.format(id=id)
+                        continue
+                    allowed.append(request['id'])
+                    results[id] = \
+                        pakreq.telegram_consts.PROCESS_SUCCESS.format(id=id)
+                if rtype == pakreq.db.RequestStatus.OPEN:
+                    await pakreq.pakreq.update_requests(
+                        conn, allowed, status=rtype
+                    )
+                else:
+                    await pakreq.pakreq.update_requests(
+                        conn, allowed, status=rtype, packager_id=user_id
                     )
+            result = ''.join(results[id] for id in ids)
         await message.reply(result, parse_mode='HTML')
 
     async def new_request(self, message: types.Message):
@@ -637,8 +837,7 @@ class PakreqBot(object):
             )
             return
         async with self.app['db'].acquire() as conn:
-            user = await pakreq.pakreq.get_user_from_oauth_id(
-                conn, OAuthType.Telegram, message.from_user.id)
+            user = await self.get_user(conn, message.from_user.id)
             if user is None:
                 await message.reply(
                     pakreq.telegram_consts.REGISTER_FIRST,
@@ -646,37 +845,38 @@ class PakreqBot(object):
                 )
                 return
             user_id = user['id']
-            requests = await pakreq.pakreq.get_open_requests(conn)
-            for request in requests:
-                if (request['name'] == splitted[1]) and\
-                        (request['type'] == rtype):
-                    await message.reply(
-                        pakreq.telegram_consts.IS_ALREADY_IN_THE_LIST
-                        .format(
-                            rtype=escape(splitted[0].split(
-                                '@')[0][1:].capitalize()),
-                            name=escape(str(splitted[1]))
-                        ),
-                        parse_mode='HTML'
-                    )
-                    return
-            id = await pakreq.pakreq.get_max_request_id(conn) + 1
-            await pakreq.pakreq.new_request(
-                conn, id=id, rtype=rtype,
-                name=splitted[1],
-                description=description,
-                requester_id=user_id
-            )
-        await message.reply(
-            pakreq.telegram_consts.SUCCESSFULLY_ADDED.format(
-                rtype=escape(splitted[0].split('@')[0][1:]),
-                name=escape(str(splitted[1])),
-                id=str(id)
-            )
+            try:
+                id = await pakreq.pakreq.new_request(
+                    conn, rtype=rtype,
+                    name=splitted[1],
+                    description=description,
+                    requester_id=user_id
+                )
+            except pakreq.db.DuplicateRecordException:
+                await message.reply(
+                    pakreq.telegram_consts.IS_ALREADY_IN_THE_LIST
+                    .format(
+                        rtype=escape(splitted[0].split(
+                            '@')[0][1:].capitalize()),
+                        name=escape(str(splitted[1]))
+                    ),
+                    parse_mode='HTML'
+                )
+                return
+        result = pakreq.telegram_consts.SUCCESSFULLY_ADDED.format(
+            rtype=escape(splitted[0].split('@')[0][1:]),
+            name=escape(str(splitted[1])),
+            id=str(id)
         )
+        similar = await self.similar_requests(splitted[1], exclude=id)
+        if similar:
+            result += pakreq.telegram_consts.SIMILAR_REQUESTS_EXIST.format(
+                requests=similar
+            )
+        await message.reply(result, parse_mode='HTML')
 
-    def start(self):
-        """Register message handlers, and start the bot"""
+    def register_handlers(self):
+        """Register message handlers"""
         commands_mapping = [
             (['link'], self.link_account),
             (['list'], self.list_requests),
@@ -691,12 +891,54 @@ class PakreqBot(object):
             (['start', 'help'], self.show_help),
             (['done', 'reject', 'reopen'], self.set_status),
             (['pakreq', 'updreq', 'optreq'], self.new_request),
-            (['unlink'], self.unlink_account)
+            (['unlink'], self.unlink_account),
+            (['stats'], self.show_stats)
         ]
         for command in commands_mapping:
             logging.info('Registering command: %s' % command[0])
             self.dp.register_message_handler(command[1], commands=command[0])
-        executor.start_polling(self.dp)
+
+    def setup_webhook(self, app):
+        """Serve Telegram webhook on an aiohttp app"""
+        conf = self.app['config']['telegram']
+        pakreq.webhook.setup_webhook(
+            app, self.dp, conf['webhook_path'],
+            url=conf['webhook_url'], secret=conf['webhook_secret'],
+            workers=conf['workers'], queue_size=conf['queue_size']
+        )
+
+    def mount(self, app):
+        """Serve the bot on an existing aiohttp app (the web server),
+        sharing its database pool and password hashing pool"""
+        self.register_handlers()
+
+        async def on_startup(app):
+            self.app['db'] = app['db']
+            self.app['passwords'] = app['passwords']
+            await pakreq.packages.init_packages(self.app)
+            await self.build_name_index()
+
+        async def on_cleanup(app):
+            await pakreq.packages.close_packages(self.app)
+            await (await self.bot.get_session()).close()
+
+        # Before the webhook's own startup, which starts handling updates
+        app.on_startup.append(on_startup)
+        self.setup_webhook(app)
+        app.on_cleanup.append(on_cleanup)
+
+    def start(self):
+        """Register message handlers, and start the bot"""
+        self.register_handlers()
+        conf = self.app['config']['telegram']
+        if conf['mode'] == 'webhook':
+            app = web.Application()
+            self.setup_webhook(app)
+            app.on_cleanup.append(self.shutdown)
+            web.run_app(app, host=conf['webhook_host'],
+                        port=conf['webhook_port'])
+        else:
+            executor.start_polling(self.dp, on_shutdown=self.shutdown)
 
 
 def start_bot(config):
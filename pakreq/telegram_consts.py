@@ -21,6 +21,10 @@ FULL_LIST = """
 Please visit {url} for the full list of requests.
 """
 
+NEXT_PAGE = """
+More requests: /list after {id}
+"""
+
 REQUEST_BRIEF_INFO = """\
 ID: {id} <b>{name}</b> (<i>{rtype}</i>): {description}
 """
@@ -56,10 +60,26 @@ SUCCESSFULLY_ADDED = """\
 Successfully added {name} to the {rtype} list, id of this request is {id}.
 """
 
+SIMILAR_REQUEST = """\
+ID: {id} <b>{name}</b>
+"""
+
+SIMILAR_REQUESTS_EXIST = """
+Similar requests already exist, please check if they are the same:
+{requests}"""
+
+DID_YOU_MEAN = """
+Did you mean:
+{requests}"""
+
 REOPEN_FIRST = """\
 <b>You have to reopen request {id} first.</b>
 """
 
+ALREADY_OPEN = """\
+<b>Request {id} can not be reopened, {name} is already in the list.</b>
+"""
+
 CLAIM_FIRST = """\
 <b>You have to claim request {id} first.</b>
 """
@@ -134,11 +154,32 @@ WHOAMI = """\
 You are <b>{username}</b> and your user ID is <b>{id}</b>.
 """
 
+ADMIN_ONLY = """\
+Only <b>admins</b> can do this.
+"""
+
+STATS = """\
+<b>Identity cache</b>: {identities[size]}/{identities[maxsize]} entries, \
+hit rate {identities[hit_rate]:.1%} \
+({identities[hits]} hits, {identities[misses]} misses)
+<b>Password hashing</b>: {passwords[jobs]} jobs, \
+{passwords[waiting]} waiting, \
+wait avg {passwords[wait_avg]:.3f}s max {passwords[wait_max]:.3f}s
+<b>Database pool</b>: {db[acquired]}/{db[maxsize]} in use, \
+{db[free]} free, {db[waiting]} waiting, {db[timeouts]} timeouts, \
+wait avg {db[wait_avg]:.3f}s max {db[wait_max]:.3f}s
+<b>Database acquire latency</b>: {db_latency}
+"""
+
 SEARCH_RESULT = """\
 <b>Results</b>:
 {matches}
 """
 
+MORE_RESULTS = """
+More results: /search page {page} {keyword}
+"""
+
 NO_MATCH_FOUND = """\
 No match for <b>{keyword}</b> found.
 """
@@ -156,7 +197,8 @@ Command list:
 /pakreq &lt;package name&gt; [description] - Add a new pakreq.
 /updreq &lt;package name&gt; [description] - Add a new updreq.
 /optreq &lt;package name&gt; [description] - Add a new optreq.
-/claim [package id] - Claim a request, leave [package] for a random claim.
+/claim [package id] - Claim a request, or the next unclaimed one without \
+[package id].
 /unclaim &lt;package id&gt; - Unclaim  a request.
 /done &lt;package id&gt; - Mark a request as done.
 /reject &lt;package id&gt; - Reject a request.
@@ -164,7 +206,9 @@ Command list:
 /edit_desc &lt;package id&gt; [description] - Edit description.
 /note &lt;package id&gt; [note] - Set a note for &lt;package id&gt;.
 /list [package id] - List requests by id, up to 5 ids at a time.
-/search &lt;keyword&gt; - Search requests.
+/list after &lt;package id&gt; - List open requests after &lt;package id&gt;.
+/search [page &lt;n&gt;] &lt;keyword&gt; - Search requests.
+/stats - Show bot statistics (admins only).
 /help - Show this help message.
 """
 
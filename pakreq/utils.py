@@ -4,15 +4,29 @@
 Utilities
 """
 
+import ujson
 import trafaret as T
 
 from json import dumps
 from argon2 import PasswordHasher
 from datetime import date, datetime
+from cryptography.fernet import Fernet
 
 from pakreq.db import RequestType, RequestStatus
+from pakreq.packages import BASE_URL as PACKAGES_URL
 from aiopg.sa.result import RowProxy
 
+
+def fernet_key(value):
+    """Check that value is a usable Fernet key"""
+    try:
+        Fernet(value)
+    except ValueError:
+        return T.DataError('is not a Fernet key (32 url-safe base64-encoded '
+                           'bytes)')
+    return value
+
+
 # Configuration checker
 TRAFARET = T.Dict({
     T.Key('db'):
@@ -21,15 +35,80 @@ TRAFARET = T.Dict({
             'username': T.String(),
             'password': T.String(allow_blank=True),
             'database': T.String(),
+            T.Key('port', default=5432): T.Int(gt=0),
+            T.Key('minsize', default=1): T.Int(gte=0),
+            T.Key('maxsize', default=10): T.Int(gt=0),
+            T.Key('acquire_timeout', default=10): T.Float(gte=0),
+            T.Key('statement_timeout', default=60): T.Float(gt=0),
+            T.Key('slow_wait', default=0.5): T.Float(gte=0),
         }),
     T.Key('telegram'):
         T.Dict({
             'token': T.String(),
+            T.Key('identity_cache_size', default=1024): T.Int(gt=0),
+            T.Key('identity_cache_ttl', default=600): T.Float(gte=0),
+            T.Key('identity_cache_negative_ttl', default=60): T.Float(gte=0),
+            T.Key('mode', default='polling'): T.Enum('polling', 'webhook'),
+            T.Key('webhook_url', default=None): (T.URL | T.Null),
+            T.Key('webhook_path', default='/telegram/webhook'): T.String(),
+            T.Key('webhook_secret', default=None): (T.String() | T.Null),
+            T.Key('webhook_host', default='127.0.0.1'): T.IP,
+            T.Key('webhook_port', default=8081): T.Int(),
+            T.Key('webhook_server', default='bot'): T.Enum('bot', 'web'),
+            T.Key('workers', default=4): T.Int(gt=0),
+            T.Key('queue_size', default=100): T.Int(gt=0),
+            T.Key('claim_order', default='oldest'):
+                T.Enum('oldest', 'newest'),
         }),
     T.Key('host'): T.IP,
     T.Key('port'): T.Int(),
     T.Key('base_url'): T.URL,
-    T.Key('ldap_url'): (T.String() | T.Null)
+    T.Key('ldap_url'): (T.String() | T.Null),
+    T.Key('ldap', default={}):
+        T.Dict({
+            T.Key('pool_size', default=2): T.Int(gt=0),
+            T.Key('timeout', default=10): T.Float(gt=0),
+            T.Key('cache_ttl', default=300): T.Float(gte=0),
+        }),
+    T.Key('packages', default={}):
+        T.Dict({
+            T.Key('url', default=PACKAGES_URL): T.URL,
+            T.Key('connections', default=8): T.Int(gt=0),
+            T.Key('keepalive', default=60): T.Float(gte=0),
+            T.Key('timeout', default=30): T.Float(gt=0),
+            T.Key('rate_limit', default=10): T.Float(gte=0),
+            T.Key('cache_size', default=4096): T.Int(gt=0),
+            T.Key('cache_ttl', default=1800): T.Float(gte=0),
+            T.Key('cache_negative_ttl', default=300): T.Float(gte=0),
+            T.Key('snapshot_path', default='/list.json'): T.String(),
+        }),
+    T.Key('daemon', default={}):
+        T.Dict({
+            T.Key('interval', default=1800): T.Int(gt=0),
+            T.Key('mode', default='query'): T.Enum('query', 'snapshot'),
+            T.Key('concurrency', default=8): T.Int(gt=0),
+            T.Key('batch_size', default=100): T.Int(gt=0),
+        }),
+    T.Key('web', default={}):
+        T.Dict({
+            T.Key('workers', default=0): T.Int(gte=0),
+            T.Key('export_batch_size', default=500): T.Int(gt=0),
+            T.Key('page_size', default=50): T.Int(gt=0),
+            T.Key('cache_size', default=256): T.Int(gt=0),
+            T.Key('revision_ttl', default=1): T.Float(gte=0),
+            T.Key('session_store', default='cookie'):
+                T.Enum('cookie', 'database'),
+            T.Key('session_key', default=None):
+                (T.String() & T.Call(fernet_key) | T.Null),
+            T.Key('session_max_age', default=604800): T.Int(gt=0),
+            T.Key('session_cache_size', default=1024): T.Int(gt=0),
+            T.Key('session_cache_ttl', default=2): T.Float(gte=0),
+        }),
+    T.Key('passwords', default={}):
+        T.Dict({
+            T.Key('workers', default=2): T.Int(gt=0),
+            T.Key('slow_wait', default=1): T.Float(gte=0),
+        })
 })
 
 
@@ -57,6 +136,26 @@ def get_status(status):
         return 'UnknownJellyStatusException'
 
 
+def json_value(value):
+    """Turn database values into ones JSON can hold"""
+    if isinstance(value, RequestType):
+        return get_type(value)
+    if isinstance(value, RequestStatus):
+        return get_status(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (dict, RowProxy)):
+        return {k: json_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_value(v) for v in value]
+    return value
+
+
+def dump_json(value):
+    """Serialize database values (requests, users...) as JSON"""
+    return ujson.dumps(json_value(value), ensure_ascii=False)
+
+
 def get_password_hasher():
     # time cost: 2^3, memory_cost: 2^16
     return PasswordHasher(time_cost=8, memory_cost=65536)
@@ -82,6 +181,18 @@ def password_verify(id, password, hash):
         return False
 
 
+# Markers around search matches highlighted by the database, they survive
+# escape() and are turned into HTML tags by highlight()
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+
+def highlight(text):
+    """Escape text highlighted by the database and bold the matches"""
+    return escape(text).replace(HIGHLIGHT_START, '<b>') \
+        .replace(HIGHLIGHT_STOP, '</b>')
+
+
 def escape(text):
     """Escape string to avoid explosion"""
     try:
@@ -0,0 +1,209 @@
+# views.py
+
+"""
+Views
+"""
+
+from aiohttp import web
+from aiohttp_jinja2 import render_template_async
+from aiohttp_security import remember, forget, authorized_userid
+from aiohttp_session import new_session
+
+from pakreq.db import RequestStatus, RequestType, RecordNotFoundException
+from pakreq.pakreq import (
+    get_user, get_requests_batch, get_request_details,
+    get_open_request_details, get_requests_by_user
+)
+from pakreq.httpcache import set_validators
+from pakreq.utils import dump_json
+from pakreq.webauth import check_credentials
+
+
+def parse_ids(request):
+    """IDs in the URL of request, like /detail/1,2,3"""
+    return [int(id) for id in request.match_info['ids'].split(',')]
+
+
+def json_response(value, status=200):
+    """Respond with value serialized by dump_json"""
+    return web.Response(
+        text=dump_json(value), status=status,
+        content_type='application/json'
+    )
+
+
+async def fetch_details(request):
+    """Details of requests in the URL, ordered as in the URL"""
+    ids = parse_ids(request)
+    async with request.app['db'].acquire() as conn:
+        details = await get_request_details(conn, ids)
+    return [details[id] for id in ids if id in details]
+
+
+def parse_filters(query):
+    """Filters of GET /requests from query string, raises KeyError or
+    ValueError if invalid"""
+    filters = dict()
+    if 'status' in query:
+        filters['status'] = RequestStatus[query['status'].upper()]
+    if 'type' in query:
+        filters['rtype'] = RequestType[query['type'].upper()]
+    if 'requester' in query:
+        filters['requester_id'] = int(query['requester'])
+    if 'since_id' in query:
+        filters['after_id'] = int(query['since_id'])
+    return filters
+
+
+# RESTful API
+async def requests_all(request):
+    """Requests ordered by ID, streamed as a JSON array, or as one JSON
+    object per line with ?format=ndjson. Can be filtered by status, type,
+    requester (ID) and since_id (only requests with greater IDs)."""
+    try:
+        filters = parse_filters(request.query)
+    except (KeyError, ValueError):
+        return json_response({'error': 'Invalid filter'}, status=400)
+    etag, modified, response = await request.app['responses'].check(request)
+    if response is not None:
+        return response
+    ndjson = request.query.get('format') == 'ndjson'
+    # Exports can be arbitrary large, they are not cached
+    response = web.StreamResponse()
+    if etag is not None:
+        set_validators(response, etag, modified)
+    response.content_type = \
+        'application/x-ndjson' if ndjson else 'application/json'
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    if not ndjson:
+        await response.write(b'[')
+    batch_size = request.app['config']['web']['export_batch_size']
+    first = True
+    while True:
+        # A connection is only held while fetching, not while sending
+        async with request.app['db'].acquire() as conn:
+            rows = await get_requests_batch(conn, limit=batch_size, **filters)
+        if not rows:
+            break
+        if ndjson:
+            chunk = ''.join(dump_json(row) + '\n' for row in rows)
+        else:
+            chunk = dump_json(rows)[1:-1]
+            if not first:
+                chunk = ',' + chunk
+        await response.write(chunk.encode())
+        first = False
+        if len(rows) < batch_size:
+            break
+        filters['after_id'] = rows[-1]['id']
+    if not ndjson:
+        await response.write(b']')
+    await response.write_eof()
+    return response
+
+
+async def request_detail(request):
+    """Details of requests"""
+    async def render():
+        details = await fetch_details(request)
+        if not details:
+            return json_response({'error': 'Request not found'}, status=404)
+        return json_response(details)
+    return await request.app['responses'].respond(request, render)
+
+
+# Pages
+async def index(request):
+    """List of open requests, a page at a time, ?after=<id> for the page
+    after request <id>"""
+    user = await authorized_userid(request)
+    try:
+        after_id = int(request.query['after']) \
+            if 'after' in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest()
+
+    async def render():
+        async with request.app['db'].acquire() as conn:
+            requests, has_more = await get_open_request_details(
+                conn, after_id=after_id,
+                per_page=request.app['config']['web']['page_size']
+            )
+        return await render_template_async(
+            'index.html', request,
+            {'requests': requests, 'has_more': has_more, 'user': user}
+        )
+    return await request.app['responses'].respond(
+        request, render, user, personal=True
+    )
+
+
+async def detail(request):
+    """Details of requests"""
+    user = await authorized_userid(request)
+
+    async def render():
+        details = await fetch_details(request)
+        if not details:
+            raise web.HTTPNotFound()
+        return await render_template_async(
+            'detail.html', request, {'requests': details, 'user': user}
+        )
+    return await request.app['responses'].respond(
+        request, render, user, personal=True
+    )
+
+
+async def login(request):
+    """Login page"""
+    if await authorized_userid(request) is not None:
+        raise web.HTTPFound('/account')
+    return await render_template_async(
+        'login.html', request, {'error': None, 'user': None}
+    )
+
+
+async def auth(request):
+    """Check login form"""
+    form = await request.post()
+    user = await check_credentials(
+        request.app, form.get('username', ''), form.get('password', '')
+    )
+    if user is None:
+        return await render_template_async(
+            'login.html', request,
+            {'error': 'Invalid username or password', 'user': None},
+            status=401
+        )
+    # A new session with a new key, so a session planted before login
+    # (session fixation) never gets authenticated
+    await new_session(request)
+    response = web.HTTPFound('/account')
+    await remember(request, response, str(user['id']))
+    raise response
+
+
+async def account(request):
+    """Account page, with requests of the user"""
+    id = await authorized_userid(request)
+    if id is None:
+        raise web.HTTPFound('/login')
+    async with request.app['db'].acquire() as conn:
+        try:
+            user = await get_user(conn, id)
+        except RecordNotFoundException:
+            raise web.HTTPFound('/login')
+        requests = await get_requests_by_user(conn, id)
+    return await render_template_async(
+        'account.html', request, {
+            'account': user, 'requests': requests, 'user': id
+        }
+    )
+
+
+async def logout(request):
+    """Logout and back to index"""
+    response = web.HTTPFound('/')
+    await forget(request, response)
+    raise response
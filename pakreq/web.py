@@ -0,0 +1,173 @@
+# web.py
+
+"""
+Web server
+"""
+
+import copy
+import time
+import uvloop
+import signal
+import asyncio
+import logging
+
+from multiprocessing import Process
+from multiprocessing.connection import wait
+
+import jinja2
+import aiohttp_jinja2
+
+from aiohttp import web
+
+from pakreq.db import init_db, close_db
+from pakreq.httpcache import init_response_cache
+from pakreq.passwords import init_passwords, close_passwords
+from pakreq.routes import setup_routes
+from pakreq.settings import get_web_workers
+from pakreq.telegram import PakreqBot
+from pakreq.utils import get_type, get_status
+
+logger = logging.getLogger(__name__)
+
+
+async def init_ldap(app):
+    """Initialize LDAP authentication, if configured"""
+    if not app['config']['ldap_url']:
+        return
+    # python-ldap is only needed when LDAP is in use
+    from pakreq.ldap import init_ldap
+    await init_ldap(app)
+
+
+async def close_ldap(app):
+    """Close LDAP authentication, if initialized"""
+    if 'ldap' in app:
+        app['ldap'].close()
+
+
+def serves_webhook(config):
+    """Whether the web server also serves the Telegram webhook"""
+    conf = config['telegram']
+    return conf['mode'] == 'webhook' and conf['webhook_server'] == 'web'
+
+
+def init_app(config):
+    """Build the web application"""
+    app = web.Application()
+    app['config'] = config
+    aiohttp_jinja2.setup(
+        app, enable_async=True, autoescape=True,
+        loader=jinja2.PackageLoader('pakreq', 'templates'),
+        filters={'rtype': get_type, 'status': get_status}
+    )
+    setup_routes(app)
+    app.on_startup.extend(
+        [init_db, init_passwords, init_ldap, init_response_cache]
+    )
+    if serves_webhook(config):
+        PakreqBot(config).mount(app)
+    app.on_cleanup.extend([close_db, close_passwords, close_ldap])
+    return app
+
+
+def worker_config(config, workers):
+    """Config of one of `workers` web workers, with its slice of the
+    database pool and of the password hashing workers"""
+    config = copy.deepcopy(config)
+    conf = config['db']
+    conf['maxsize'] = max(1, conf['maxsize'] // workers)
+    conf['minsize'] = min(conf['minsize'], conf['maxsize'])
+    # Every web worker hashes with at least one worker of its own
+    conf = config['passwords']
+    conf['workers'] = max(1, conf['workers'] // workers)
+    return config
+
+
+def graceful_exit(*args):
+    """Stop a web worker like aiohttp does once it is running, so cleanup
+    (closing the database pool and the like) still happens"""
+    raise web.GracefulExit()
+
+
+def serve(config):
+    """Run a web worker, sharing its port with the other workers"""
+    # Forked from the supervisor, drop its signal handlers. aiohttp
+    # replaces these once the app runs.
+    signal.signal(signal.SIGTERM, graceful_exit)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    web.run_app(
+        init_app(config), host=config['host'], port=config['port'],
+        reuse_port=True, print=None
+    )
+
+
+class Supervisor(object):
+    """Keeps `workers` web worker processes running, restarting those that
+    exit until stopped"""
+
+    # Seconds to wait before restarting a worker that died right away
+    RESTART_DELAY = 1
+    # Seconds workers get to clean up before they are killed
+    SHUTDOWN_TIMEOUT = 10
+
+    def __init__(self, config, workers):
+        self.config = worker_config(config, workers)
+        self.workers = workers
+        self.processes = dict()
+        self.started = dict()
+        self.stopping = False
+
+    def spawn(self, index):
+        """Start worker index"""
+        process = Process(
+            target=serve, args=(self.config, ), name='pakreq-web-%s' % index
+        )
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+        logger.info('Web worker %s started (PID: %s)' % (index, process.pid))
+
+    def stop(self, *args):
+        """Ask the supervisor to stop"""
+        self.stopping = True
+
+    def run(self):
+        """Start the workers and restart them until stopped"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        while not self.stopping:
+            wait([p.sentinel for p in self.processes.values()], timeout=1)
+            for index, process in list(self.processes.items()):
+                if self.stopping or process.is_alive():
+                    continue
+                logger.warning('Web worker %s (PID: %s) exited with %s' %
+                               (index, process.pid, process.exitcode))
+                process.join()
+                # Do not spin on workers that cannot start at all
+                if time.monotonic() - self.started[index] < \
+                        self.RESTART_DELAY:
+                    time.sleep(self.RESTART_DELAY)
+                self.spawn(index)
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT
+        for process in self.processes.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning('Web worker (PID: %s) did not stop in time, '
+                               'killing it' % process.pid)
+                process.kill()
+                process.join()
+        logger.info('Web workers stopped')
+
+
+def start_web(config):
+    """Start the web server, in as many worker processes as configured"""
+    workers = get_web_workers(config)
+    logger.info('Serving on %s:%s with %s workers' %
+                (config['host'], config['port'], workers))
+    Supervisor(config, workers).run()
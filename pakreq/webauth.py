@@ -0,0 +1,70 @@
+# webauth.py
+
+"""
+Web authentication and authorization
+"""
+
+import logging
+
+from aiohttp_security.abc import AbstractAuthorizationPolicy
+
+from pakreq.cache import TTLCache
+from pakreq.db import check_password, RecordNotFoundException
+from pakreq.pakreq import get_user, get_user_by_name
+
+logger = logging.getLogger(__name__)
+
+
+class PakreqAuth(AbstractAuthorizationPolicy):
+    """Authorization policy, identities are user IDs"""
+
+    def __init__(self, app):
+        self.app = app
+        conf = app['config']['web']
+        self.users = TTLCache(maxsize=conf['session_cache_size'],
+                              ttl=conf['session_cache_ttl'], negative_ttl=0)
+
+    async def get_user(self, identity):
+        """Find the user of identity, None if there is none"""
+        try:
+            id = int(identity)
+        except (TypeError, ValueError):
+            return None
+
+        async def fetch():
+            async with self.app['db'].acquire() as conn:
+                try:
+                    return await get_user(conn, id)
+                except RecordNotFoundException:
+                    return None
+        return await self.users.get_or_fetch(id, fetch)
+
+    async def authorized_userid(self, identity):
+        user = await self.get_user(identity)
+        return user and user['id']
+
+    async def permits(self, identity, permission, context=None):
+        user = await self.get_user(identity)
+        if user is None:
+            return False
+        if permission == 'admin':
+            return user['admin']
+        return True
+
+
+async def check_credentials(app, username, password):
+    """Check login of username with local password first, then LDAP,
+    returns the user or None"""
+    async with app['db'].acquire() as conn:
+        user = await get_user_by_name(conn, username)
+        if user is None:
+            return None
+        if user['password_hash'] and await check_password(
+            conn, app['passwords'], user, password
+        ):
+            return user
+    ldap = app.get('ldap')
+    if ldap is not None and await ldap.login(username, password):
+        return user
+    logger.info('Failed login of %s' % username)
+    return None
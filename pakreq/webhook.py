@@ -0,0 +1,108 @@
+# webhook.py
+
+"""
+Telegram webhook serving
+"""
+
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot, types
+from aiogram.dispatcher import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_chat_id(update):
+    """Find out which chat an update belongs to"""
+    for kind in ('message', 'edited_message',
+                 'channel_post', 'edited_channel_post'):
+        message = getattr(update, kind)
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None:
+        return update.callback_query.from_user.id
+    return 0
+
+
+class UpdateWorkers(object):
+    """Process updates on a fixed set of workers. Updates of the same chat
+    always go to the same worker, so they are handled in order, while
+    different chats are handled concurrently."""
+
+    def __init__(self, dp, workers=4, queue_size=100):
+        self.dp = dp
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queues = []
+        self.tasks = []
+
+    def start(self):
+        """Start the workers (must be called inside the event loop)"""
+        # Workers run in their own tasks, give them the handler context
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        for _ in range(self.workers):
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self.queues.append(queue)
+            self.tasks.append(asyncio.ensure_future(self.work(queue)))
+
+    async def put(self, update):
+        """Queue an update, waits if its worker is too far behind"""
+        queue = self.queues[hash(update_chat_id(update)) % self.workers]
+        await queue.put(update)
+
+    async def work(self, queue):
+        """Worker loop"""
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.process_update(update)
+            except Exception:
+                logger.exception('Failed to process update %s' %
+                                 update.update_id)
+            finally:
+                queue.task_done()
+
+    async def close(self):
+        """Finish queued updates and stop the workers"""
+        for queue in self.queues:
+            await queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.queues = []
+        self.tasks = []
+
+
+def setup_webhook(app, dp, path, url=None, secret=None, workers=4,
+                  queue_size=100):
+    """Serve Telegram webhook of dispatcher dp at path of aiohttp app.
+    If url (the public base URL of app) is given, the webhook is
+    registered with Telegram on startup."""
+    update_workers = UpdateWorkers(dp, workers=workers, queue_size=queue_size)
+
+    async def handle(request):
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=403)
+        update = types.Update.to_object(await request.json())
+        await update_workers.put(update)
+        return web.Response()
+
+    async def on_startup(app):
+        update_workers.start()
+        if url:
+            await dp.bot.set_webhook(url.rstrip('/') + path,
+                                     secret_token=secret)
+            logger.info('Webhook set to %s%s' % (url.rstrip('/'), path))
+
+    async def on_cleanup(app):
+        await update_workers.close()
+
+    app.router.add_post(path, handle)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app['telegram_workers'] = update_workers
@@ -30,6 +30,7 @@ install_requires = ['ujson',
                     'uvloop',
                     'aiogram',
                     'aiohttp',
+                    'aiopg',
                     'packaging',
                     'aiosqlite3',
                     'sqlalchemy',
@@ -37,6 +38,8 @@ install_requires = ['ujson',
                     'argon2_cffi',
                     'python-ldap',
                     'aiohttp-jinja2',
+                    'aiohttp-session[secure]',
+                    'aiohttp-security',
                     'trafaret-config']
 
 
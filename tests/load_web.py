@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# load_web.py
+
+"""
+Load test of the web server, against the database of the given config:
+
+    python tests/load_web.py -c config/pakreq.yaml --duration 10
+
+Prints requests/sec of list and detail endpoints.
+"""
+
+import sys
+import time
+import uvloop
+import asyncio
+import argparse
+
+from aiohttp import ClientSession, TCPConnector, web
+
+from pakreq.settings import get_config
+from pakreq.web import init_app
+
+
+async def hammer(session, url, duration, concurrency):
+    """GET url from `concurrency` clients for `duration` seconds, returns
+    (requests, errors)"""
+    deadline = time.monotonic() + duration
+    counts = [0, 0]
+
+    async def client():
+        while time.monotonic() < deadline:
+            async with session.get(url) as resp:
+                await resp.read()
+                counts[resp.status != 200] += 1
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return counts
+
+
+async def main(argv):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--duration', type=float, default=10)
+    ap.add_argument('--concurrency', type=int, default=32)
+    ap.add_argument('--port', type=int, default=18080)
+    options, _ = ap.parse_known_args(argv)
+    config = get_config(argv)
+
+    runner = web.AppRunner(init_app(config), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', options.port).start()
+    base = 'http://127.0.0.1:%s' % options.port
+    connector = TCPConnector(limit=options.concurrency)
+    async with ClientSession(connector=connector) as session:
+        async with session.get(base + '/requests') as resp:
+            ids = [str(r['id']) for r in (await resp.json())[:10]]
+        paths = ['/requests', '/']
+        if ids:
+            paths += ['/request/' + ids[0], '/detail/' + ids[0],
+                      '/request/' + ','.join(ids)]
+        for path in paths:
+            started = time.monotonic()
+            done, errors = await hammer(session, base + path,
+                                        options.duration, options.concurrency)
+            elapsed = time.monotonic() - started
+            print('%-40s %8.1f req/s (%s errors)' %
+                  (path, done / elapsed, errors))
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(main(sys.argv[1:]))
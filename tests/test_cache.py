@@ -0,0 +1,47 @@
+# test_cache.py
+
+import asyncio
+
+from pakreq.cache import TTLCache
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_negative_ttl():
+    cache = TTLCache(ttl=60, negative_ttl=0)
+    cache.set('found', {'pkg': {}})
+    cache.set('missing', None)
+    assert 'found' in cache
+    assert 'missing' not in cache
+
+
+def test_concurrent_fetches_are_collapsed():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'value'
+
+    async def main():
+        cache = TTLCache()
+        results = await asyncio.gather(
+            *[cache.get_or_fetch('key', fetch) for _ in range(5)]
+        )
+        return cache, results
+
+    cache, results = asyncio.run(main())
+    assert results == ['value'] * 5
+    assert len(calls) == 1
+    assert cache.stats()['misses'] == 5
+    assert cache.get('key') == 'value'
+    assert cache.stats()['hits'] == 1
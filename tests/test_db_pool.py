@@ -0,0 +1,95 @@
+# test_db_pool.py
+
+import asyncio
+
+import pytest
+
+from pakreq.db import PoolMonitor
+
+
+class FakeConnection(object):
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def close(self):
+        self.engine.release(self)
+
+
+class FakeEngine(object):
+    """Stands in for an aiopg.sa engine of maxsize connections"""
+
+    def __init__(self, maxsize):
+        self.maxsize = self.size = self.freesize = maxsize
+        self.free = None
+
+    async def acquire(self):
+        if self.free is None:
+            self.free = asyncio.Semaphore(self.maxsize)
+        await self.free.acquire()
+        self.freesize -= 1
+        return FakeConnection(self)
+
+    def release(self, conn):
+        self.freesize += 1
+        self.free.release()
+
+
+def test_acquisitions_are_counted():
+    pool = PoolMonitor(FakeEngine(2), acquire_timeout=1)
+    seen = []
+
+    async def hold():
+        async with pool.acquire():
+            seen.append(pool.stats()['acquired'])
+            await asyncio.sleep(0.05)
+
+    async def main():
+        await asyncio.gather(*[hold() for _ in range(4)])
+
+    asyncio.run(main())
+    stats = pool.stats()
+    assert max(seen) == 2
+    assert stats['acquisitions'] == 4
+    assert stats['acquired'] == 0 and stats['waiting'] == 0
+    assert sum(count for _, count in stats['histogram']) == 4
+    assert stats['wait_max'] >= 0.04
+
+
+def test_acquire_timeout():
+    pool = PoolMonitor(FakeEngine(1), acquire_timeout=0.05)
+
+    async def main():
+        conn = await pool.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.acquire()
+        await conn.close()
+        async with pool.acquire():
+            pass
+
+    asyncio.run(main())
+    assert pool.stats()['timeouts'] == 1
+    assert pool.stats()['acquisitions'] == 2
+
+
+class LateEngine(FakeEngine):
+    """Gets the connection even if cancelled while waiting for it"""
+
+    async def acquire(self):
+        try:
+            await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            pass
+        return await super().acquire()
+
+
+def test_connection_acquired_too_late_is_released():
+    engine = LateEngine(1)
+    pool = PoolMonitor(engine, acquire_timeout=0.05)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.acquire()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert engine.freesize == 1
@@ -0,0 +1,25 @@
+# test_fuzzy.py
+
+from pakreq.fuzzy import TrigramIndex
+
+
+def test_search_finds_typos():
+    index = TrigramIndex()
+    for key, name in enumerate(['firefox', 'thunderbird', 'libreoffice']):
+        index.add(key, name)
+    results = index.search('firefx')
+    assert results[0][:2] == (0, 'firefox')
+    assert index.search('zsh') == []
+
+
+def test_add_replaces_and_remove_drops():
+    index = TrigramIndex()
+    index.add(1, 'gtk3')
+    index.add(1, 'qt5')
+    assert len(index) == 1
+    assert index.search('gtk3') == []
+    assert index.search('qt5')[0][0] == 1
+    index.remove(1)
+    assert len(index) == 0
+    assert index.postings == {}
+    assert index.memory_usage() > 0
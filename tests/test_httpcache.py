@@ -0,0 +1,137 @@
+# test_httpcache.py
+
+import asyncio
+
+from datetime import datetime, timezone
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from pakreq.httpcache import ResponseCache
+
+MODIFIED = datetime(2020, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc)
+
+
+def test_conditional_requests():
+    renders = []
+    responses = ResponseCache(revision_ttl=60)
+
+    async def handler(request):
+        async def render():
+            renders.append(request.path)
+            return web.Response(text='hello')
+        return await responses.respond(request, render)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/', handler)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        # Revision known in advance, no database involved
+        responses.revision.set(None, (5, MODIFIED, True))
+        resp = await client.get('/')
+        assert resp.status == 200 and await resp.text() == 'hello'
+        assert resp.headers['ETag'] == '"5"'
+        resp = await client.get('/', headers={'If-None-Match': '"5"'})
+        assert resp.status == 304
+        resp = await client.get(
+            '/', headers={'If-Modified-Since': resp.headers['Last-Modified']}
+        )
+        assert resp.status == 304
+        resp = await client.get('/', headers={'If-None-Match': '"4"'})
+        assert resp.status == 200 and await resp.text() == 'hello'
+        assert renders == ['/']
+        responses.revision.set(None, (6, MODIFIED, True))
+        resp = await client.get('/', headers={'If-None-Match': '"5"'})
+        assert resp.status == 200 and resp.headers['ETag'] == '"6"'
+        assert renders == ['/', '/']
+        await client.close()
+
+    asyncio.run(main())
+
+
+def test_unsettled_revision():
+    renders = []
+    responses = ResponseCache(revision_ttl=60)
+
+    async def handler(request):
+        async def render():
+            renders.append(request.path)
+            return web.Response(text='hello')
+        return await responses.respond(request, render)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/', handler)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        # A transaction may still commit an older revision
+        responses.revision.set(None, (5, MODIFIED, False))
+        for _ in range(2):
+            resp = await client.get('/', headers={'If-None-Match': '"5"'})
+            assert resp.status == 200 and await resp.text() == 'hello'
+            assert 'ETag' not in resp.headers
+        assert renders == ['/', '/']
+        await client.close()
+
+    asyncio.run(main())
+
+
+def test_personal_responses():
+    responses = ResponseCache(revision_ttl=60)
+
+    async def handler(request):
+        user = request.headers.get('X-User')
+
+        async def render():
+            return web.Response(text='hello %s' % user)
+        return await responses.respond(request, render, user, personal=True)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/', handler)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        responses.revision.set(None, (5, MODIFIED, True))
+        resp = await client.get('/')
+        assert resp.headers['Vary'] == 'Cookie'
+        assert resp.headers['ETag'] == '"5-anonymous"'
+        # The date cannot tell whose page the client has
+        resp = await client.get('/', headers={
+            'If-Modified-Since': resp.headers['Last-Modified'],
+            'X-User': 'alice'
+        })
+        assert resp.status == 200 and await resp.text() == 'hello alice'
+        assert resp.headers['ETag'] == '"5-alice"'
+        resp = await client.get('/', headers={
+            'If-None-Match': '"5-alice"', 'X-User': 'alice'
+        })
+        assert resp.status == 304 and resp.headers['Vary'] == 'Cookie'
+        await client.close()
+
+    asyncio.run(main())
+
+
+def test_etag_depends_on_query():
+    responses = ResponseCache(revision_ttl=60)
+
+    async def handler(request):
+        etag, _, _ = await responses.check(request)
+        return web.Response(text=etag)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/', handler)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        responses.revision.set(None, (5, MODIFIED, True))
+        etags = [await (await client.get(path)).text() for path in (
+            '/', '/?status=open', '/?status=done',
+            '/?type=pakreq&status=open', '/?status=open&type=pakreq'
+        )]
+        assert etags[0] == '5'
+        assert len(set(etags[:4])) == 4
+        assert etags[3] == etags[4]
+        await client.close()
+
+    asyncio.run(main())
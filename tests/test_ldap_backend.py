@@ -0,0 +1,76 @@
+# test_ldap_backend.py
+
+import asyncio
+
+import pytest
+
+ldap = pytest.importorskip('ldap')
+
+from pakreq.ldap import PakreqLDAP  # noqa: E402
+
+
+class FakeConnection(object):
+    """Stands in for an LDAP server connection"""
+
+    users = {'aosc': 'secret'}
+
+    def __init__(self):
+        self.binds = 0
+        self.closed = False
+
+    def sasl_interactive_bind_s(self, who, auth):
+        self.binds += 1
+        self.user = auth.cb_value_dict[ldap.sasl.CB_AUTHNAME]
+        if self.users.get(self.user) != auth.cb_value_dict[ldap.sasl.CB_PASS]:
+            raise ldap.INVALID_CREDENTIALS()
+
+    def whoami_s(self):
+        return 'dn: uid=%s,cn=users,dc=aosc,dc=io' % self.user
+
+    def unbind(self):
+        self.closed = True
+
+
+def make_backend():
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    backend = PakreqLDAP('ldap://fake/', pool_size=1, connect=connect)
+    return backend, connections
+
+
+def test_login_reuses_connection():
+    backend, connections = make_backend()
+    assert asyncio.run(backend.login('aosc', 'secret'))
+    assert not asyncio.run(backend.login('aosc', 'wrong'))
+    assert len(connections) == 1
+    assert connections[0].binds == 2
+    backend.close()
+    assert connections[0].closed
+
+
+def test_successful_login_is_cached():
+    backend, connections = make_backend()
+
+    async def login_twice():
+        return [await backend.login('aosc', 'secret') for _ in range(2)]
+
+    assert asyncio.run(login_twice()) == [True, True]
+    assert connections[0].binds == 1
+
+
+def test_stale_pooled_connection_is_replaced():
+    backend, connections = make_backend()
+    stale = connections[0]
+
+    def server_down(who, auth):
+        raise ldap.SERVER_DOWN()
+
+    # The pooled connection dies while idle, e.g. the server restarted
+    stale.sasl_interactive_bind_s = server_down
+    assert backend.ldap_login('aosc', 'secret')
+    assert stale.closed
+    assert len(connections) == 2 and connections[1].binds == 1
@@ -0,0 +1,69 @@
+# test_packages.py
+
+import asyncio
+import pathlib
+
+import pytest
+
+from aiohttp import web, ClientResponseError
+from aiohttp.test_utils import TestServer
+
+from pakreq.db import RequestStatus, RequestType
+from pakreq.packages import PackageIndex, PackagesClient
+from pakreq.pakreq import check_request, find_package
+
+FIXTURE = pathlib.Path(__file__).parent / 'fixtures' / 'packages-list.json'
+
+
+def test_index_lookup():
+    index = PackageIndex.from_file(FIXTURE)
+    assert len(index) == 5
+    assert asyncio.run(find_package(index, 'bash')) == 'bash'
+    assert asyncio.run(find_package(index, 'wps-office')) == 'wpsoffice'
+    assert asyncio.run(find_package(index, 'zsh')) is None
+
+
+def test_check_request_against_index():
+    index = PackageIndex.from_file(FIXTURE)
+
+    def check(rtype, name, description='N/A'):
+        request = dict(id=1, type=rtype, name=name, description=description)
+        return asyncio.run(check_request(index, request))
+
+    assert check(RequestType.PAKREQ, 'gtk3')[0] == RequestStatus.DONE
+    assert check(RequestType.PAKREQ, 'gtk4') is None
+    assert check(RequestType.UPDREQ, 'bash', '5.1')[0] == RequestStatus.DONE
+    assert check(RequestType.UPDREQ, 'bash', '5.2') is None
+    assert check(RequestType.UPDREQ, 'zsh', '5.8')[0] == \
+        RequestStatus.REJECTED
+    assert check(RequestType.OPTREQ, 'bash') is None
+
+
+def test_site_errors_are_not_cached_as_not_found():
+    statuses = [503, 404, 200]
+
+    async def package(request):
+        status = statuses.pop(0)
+        if status == 503:
+            return web.Response(status=503, text='<html>Down</html>',
+                                content_type='text/html')
+        if status == 404:
+            return web.Response(status=404, text='Not found')
+        return web.json_response({'pkg': {'name': 'bash', 'version': '5'}})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/packages/{name}', package)
+        server = TestServer(app)
+        await server.start_server()
+        client = PackagesClient(base_url=str(server.make_url('')),
+                                cache_negative_ttl=0)
+        with pytest.raises(ClientResponseError):
+            await client.get_package_info('bash')
+        assert await client.get_package_info('bash') is None
+        assert (await client.get_package_info('bash'))['pkg']['version'] == \
+            '5'
+        await client.close()
+        await server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+# test_sessions.py
+
+import os
+import asyncio
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from trafaret import DataError
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp_session import setup as setup_session, get_session, new_session
+from cryptography.fernet import Fernet
+
+from pakreq.db import init_db, close_db
+from pakreq.pakreq import (
+    get_web_session, save_web_session, delete_expired_web_sessions
+)
+from pakreq.sessions import session_storage
+from pakreq.settings import get_config
+from pakreq.utils import TRAFARET
+
+CONFIG = {
+    'db': {'host': 'localhost', 'username': 'pakreq', 'password': '',
+           'database': 'pakreq'},
+    'telegram': {'token': '123456:ABCdefGhIJKlmnOPQrsTUVwxyz'},
+    'host': '127.0.0.1', 'port': 8080, 'base_url': 'http://localhost:8080',
+    'ldap_url': None,
+}
+
+
+def make_app(config):
+    async def login(request):
+        session = await get_session(request)
+        session['user'] = 'alice'
+        return web.Response()
+
+    async def relogin(request):
+        session = await new_session(request)
+        session['user'] = 'bob'
+        return web.Response()
+
+    async def whoami(request):
+        session = await get_session(request)
+        return web.Response(text=session.get('user', ''))
+
+    app = web.Application()
+    app['config'] = config
+    setup_session(app, session_storage(app))
+    app.router.add_get('/login', login)
+    app.router.add_get('/relogin', relogin)
+    app.router.add_get('/whoami', whoami)
+    if config['web']['session_store'] == 'database':
+        app.on_startup.append(init_db)
+        app.on_cleanup.append(close_db)
+    return app
+
+
+async def whoami_after_restart(config):
+    client = TestClient(TestServer(make_app(config)))
+    await client.start_server()
+    resp = await client.get('/login')
+    cookie = resp.cookies['AIOHTTP_SESSION'].value
+    await client.close()
+    # Another app (a restarted or another worker) gets the same cookie
+    client = TestClient(TestServer(make_app(config)))
+    await client.start_server()
+    resp = await client.get('/whoami', cookies={'AIOHTTP_SESSION': cookie})
+    user = await resp.text()
+    await client.close()
+    return user
+
+
+def test_sessions_survive_restart_with_configured_key():
+    config = TRAFARET.check(dict(
+        CONFIG, web={'session_key': Fernet.generate_key().decode()}
+    ))
+    assert asyncio.run(whoami_after_restart(config)) == 'alice'
+
+
+def test_sessions_are_lost_without_configured_key():
+    config = TRAFARET.check(CONFIG)
+    assert asyncio.run(whoami_after_restart(config)) == ''
+
+
+def test_malformed_session_key_is_rejected():
+    with pytest.raises(DataError):
+        TRAFARET.check(dict(CONFIG, web={'session_key': 'not-a-key'}))
+
+
+# Database sessions need a migrated database, given by the config in
+# PAKREQ_TEST_CONFIG
+@pytest.fixture
+def db_config():
+    path = os.environ.get('PAKREQ_TEST_CONFIG')
+    if not path:
+        pytest.skip('PAKREQ_TEST_CONFIG is not set')
+    config = get_config(['-c', path])
+    config['web']['session_store'] = 'database'
+    return config
+
+
+def test_database_sessions_survive_restart(db_config):
+    assert asyncio.run(whoami_after_restart(db_config)) == 'alice'
+
+
+def test_database_session_key_changes_on_new_session(db_config):
+    async def main():
+        app = make_app(db_config)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        resp = await client.get('/login')
+        old = resp.cookies['AIOHTTP_SESSION'].value
+        resp = await client.get('/relogin')
+        new = resp.cookies['AIOHTTP_SESSION'].value
+        async with app['db'].acquire() as conn:
+            assert await get_web_session(conn, old) is None
+            assert await get_web_session(conn, new) is not None
+        # The old key is useless to whoever else has it
+        resp = await client.get('/whoami', cookies={'AIOHTTP_SESSION': old})
+        assert await resp.text() == ''
+        resp = await client.get('/whoami', cookies={'AIOHTTP_SESSION': new})
+        assert await resp.text() == 'bob'
+        await client.close()
+
+    asyncio.run(main())
+
+
+def test_expired_database_sessions(db_config):
+    async def main():
+        app = make_app(db_config)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+        async with app['db'].acquire() as conn:
+            await save_web_session(
+                conn, 'expired-session',
+                '{"created": 0, "session": {"user": "alice"}}', expired
+            )
+        resp = await client.get(
+            '/whoami', cookies={'AIOHTTP_SESSION': 'expired-session'}
+        )
+        assert await resp.text() == ''
+        async with app['db'].acquire() as conn:
+            assert await delete_expired_web_sessions(conn) >= 1
+            result = await conn.execute(
+                "SELECT count(*) FROM web_session WHERE id = 'expired-session'"
+            )
+            assert await result.scalar() == 0
+        await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+# test_web_workers.py
+
+import os
+
+from pakreq.settings import get_web_workers
+from pakreq.utils import TRAFARET
+from pakreq.web import worker_config
+
+CONFIG = {
+    'db': {'host': 'localhost', 'username': 'pakreq', 'password': '',
+           'database': 'pakreq', 'minsize': 2, 'maxsize': 10},
+    'telegram': {'token': '123456:ABCdefGhIJKlmnOPQrsTUVwxyz'},
+    'host': '127.0.0.1', 'port': 8080, 'base_url': 'http://localhost:8080',
+    'ldap_url': None,
+}
+
+
+def test_worker_count():
+    assert get_web_workers(TRAFARET.check(CONFIG)) == \
+        min(os.cpu_count() or 1, 10)
+    config = TRAFARET.check(dict(CONFIG, web={'workers': 3}))
+    assert get_web_workers(config) == 3
+
+
+def test_worker_count_is_limited_by_pool():
+    # Every worker needs a connection of its own
+    config = TRAFARET.check(dict(CONFIG, web={'workers': 16}))
+    assert get_web_workers(config) == 10
+
+
+def test_pool_is_split_between_workers():
+    config = TRAFARET.check(CONFIG)
+    assert worker_config(config, 4)['db']['maxsize'] == 2
+    assert worker_config(config, 4)['db']['minsize'] == 2
+    assert worker_config(config, 16)['db']['maxsize'] == 1
+    assert worker_config(config, 16)['db']['minsize'] == 1
+    # The original config is left alone
+    assert config['db']['maxsize'] == 10
+
+
+def test_password_workers_are_split_between_workers():
+    config = TRAFARET.check(dict(CONFIG, passwords={'workers': 4}))
+    assert worker_config(config, 2)['passwords']['workers'] == 2
+    assert worker_config(config, 8)['passwords']['workers'] == 1
+    assert config['passwords']['workers'] == 4
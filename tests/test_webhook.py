@@ -0,0 +1,99 @@
+# test_webhook.py
+
+import random
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.dispatcher import Dispatcher
+
+from pakreq.webhook import UpdateWorkers, setup_webhook, SECRET_HEADER
+
+TOKEN = '123456:ABCdefGhIJKlmnOPQrsTUVwxyz'
+
+
+def make_update(update_id, chat_id, text='/ping'):
+    return types.Update.to_object({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'A'},
+            'entities': [{'type': 'bot_command', 'offset': 0,
+                          'length': len(text.split()[0])}],
+        }
+    })
+
+
+def test_updates_of_a_chat_stay_in_order():
+    handled = []
+
+    class FakeDispatcher(Dispatcher):
+        async def process_update(self, update):
+            await asyncio.sleep(random.random() / 100)
+            handled.append((update.message.chat.id, update.update_id))
+
+    async def main():
+        dp = FakeDispatcher(Bot(TOKEN))
+        workers = UpdateWorkers(dp, workers=3, queue_size=2)
+        workers.start()
+        for i in range(30):
+            await workers.put(make_update(i, chat_id=i % 5))
+        await workers.close()
+
+    asyncio.run(main())
+    assert len(handled) == 30
+    for chat_id in range(5):
+        ids = [u for c, u in handled if c == chat_id]
+        assert ids == sorted(ids)
+
+
+def test_webhook_round_trip():
+    calls = []
+
+    async def fake_api(request):
+        data = dict(await request.post())
+        calls.append((request.match_info['method'], data))
+        if request.match_info['method'] == 'sendMessage':
+            result = {'message_id': 1, 'date': 0,
+                      'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                      'text': data['text']}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def main():
+        api = web.Application()
+        api.router.add_post('/bot{token}/{method}', fake_api)
+        api_server = TestServer(api)
+        await api_server.start_server()
+        bot = Bot(TOKEN, server=TelegramAPIServer.from_base(
+            str(api_server.make_url(''))))
+        dp = Dispatcher(bot)
+
+        async def ping(message):
+            await message.reply('pong')
+        dp.register_message_handler(ping, commands=['ping'])
+
+        app = web.Application()
+        setup_webhook(app, dp, '/hook', url='https://pakreq.example.org',
+                      secret='s3cret')
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        update = make_update(1, chat_id=42).to_python()
+        resp = await client.post('/hook', json=update)
+        assert resp.status == 403
+        resp = await client.post('/hook', json=update,
+                                 headers={SECRET_HEADER: 's3cret'})
+        assert resp.status == 200
+        await client.close()
+        await (await bot.get_session()).close()
+        await api_server.close()
+
+    asyncio.run(main())
+    methods = [method for method, _ in calls]
+    assert methods == ['setWebhook', 'sendMessage']
+    assert calls[0][1]['url'] == 'https://pakreq.example.org/hook'
+    assert calls[1][1]['text'] == 'pong'